@@ -0,0 +1,550 @@
+"""CRM 離線效能量測
+
+用法: python bench_crm.py [情境 ...]   (不指定時執行全部情境)
+所有量測都在暫存目錄的本機 SQLite 資料庫上進行，不需要 Google Sheets；
+app 情境以 FakeSheetsConnection 模擬試算表 (延遲由 BENCH_SHEETS_LATENCY 秒設定，資料量由 BENCH_SCALES 設定)。
+"""
+import hashlib
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import types
+
+import pandas as pd
+from gspread.utils import a1_range_to_grid_range, a1_to_rowcol
+from streamlit.connections import BaseConnection
+
+import crm_app
+from crm_app import ClientSearchIndex, LocalStore, SalesRollup, UserIndex, check_password, coerce, hash_password
+
+TMP = tempfile.mkdtemp(prefix="crm-bench-")
+crm_app.DB_PATH = os.path.join(TMP, "app.db")  # get_store() 使用的資料庫，避免動到正式的 crm.db
+
+# --- 測試資料 ---
+SURNAMES = "陳林黃張李王吳劉蔡楊許鄭謝郭洪曾邱廖賴周"
+
+def make_clients(n, start=1):
+    ids = range(start, start + n)
+    return pd.DataFrame({
+        "id": ids,
+        "name": [f"{SURNAMES[i % 20]}{SURNAMES[i // 20 % 20]}公司{i}" for i in ids],
+        "phone": [f"09{i * 7919 % 10**8:08d}" for i in ids],
+        "email": [f"client{i}@example{i % 30}.com" for i in ids],
+        "project": [f"專案{i % 200}" for i in ids],
+        "title": [f"抬頭{i}" for i in ids],
+        "invoice_number": [f"{i * 104729 % 10**8:08d}" for i in ids],
+        "category": [("VIP", "一般", "潛在")[i % 3] for i in ids],
+        "created_at": [f"2024-{i % 12 + 1:02d}-{i % 28 + 1:02d}" for i in ids],
+        "created_by": [f"op{i % 20}" for i in ids],
+    })
+
+def make_sales(n, start=1, clients=5000):
+    ids = range(start, start + n)
+    return pd.DataFrame({
+        "id": ids,
+        "client_id": [i % clients + 1 for i in ids],
+        "transaction_date": [f"2024-{i % 12 + 1:02d}-{i % 28 + 1:02d}" for i in ids],
+        "item_name": [f"項目{i % 50}" for i in ids],
+        "invoice_number": [f"AB{i:08d}" for i in ids],
+        "sale_amount": [float(i % 997 * 100) for i in ids],
+        "created_by": [f"op{i % 20}" for i in ids],
+    })
+
+def make_interactions(n, start=1, clients=5000):
+    ids = range(start, start + n)
+    return pd.DataFrame({
+        "id": ids,
+        "client_id": [i % clients + 1 for i in ids],
+        "log_date": [f"2024-{i % 12 + 1:02d}-{i % 28 + 1:02d}" for i in ids],
+        "content": [f"跟進內容 {i}" for i in ids],
+        "follow_up_date": [f"2025-{i % 12 + 1:02d}-{i % 28 + 1:02d}" for i in ids],
+        "reminder_note": [f"提醒 {i}" for i in ids],
+        "updated_by": [f"op{i % 20}" for i in ids],
+    })
+
+def make_users(n):
+    return pd.DataFrame({
+        "username": [f"op{i}" for i in range(n)],
+        "password": [hashlib.sha256(f"pw{i}".encode()).hexdigest() for i in range(n)],
+        "role": ["admin" if i == 0 else "operator" for i in range(n)],
+        "sales_name": [f"業務{i}" for i in range(n)],
+    })
+
+def make_dataset(scale):
+    """一家公司的資料：scale 筆銷售與跟進紀錄，客戶數為其 1/5，20 位業務 (op0 為管理員)"""
+    clients = max(scale // 5, 1)
+    return {"clients": make_clients(clients), "sales": make_sales(scale, clients=clients),
+            "interactions": make_interactions(scale, clients=clients), "users": make_users(20),
+            "categories": pd.DataFrame({"name": ["VIP", "一般", "潛在"]})}
+
+# --- 模擬 Google Sheets ---
+class FakeWorksheet:
+    """記憶體中的工作表 (第一列為標頭)，實作 SheetsMirror 用到的 gspread 方法"""
+    def __init__(self, spreadsheet, sheet_id, grid):
+        self.spreadsheet, self.id, self.grid = spreadsheet, sheet_id, grid
+
+    def row_values(self, row):
+        self.spreadsheet.wait()
+        return list(self.grid[row - 1]) if len(self.grid) >= row else []
+
+    def col_values(self, col):
+        self.spreadsheet.wait()
+        return [str(r[col - 1]) if len(r) >= col else "" for r in self.grid]
+
+    def append_row(self, row, **kwargs):
+        self.append_rows([row])
+
+    def append_rows(self, rows, **kwargs):
+        self.spreadsheet.wait()
+        self.grid.extend(list(r) for r in rows)
+
+    def batch_get(self, ranges, **kwargs):
+        self.spreadsheet.wait()
+        out = []
+        for rng in ranges:
+            g = a1_range_to_grid_range(rng)
+            rows = self.grid[g.get("startRowIndex", 0):g.get("endRowIndex", len(self.grid))]
+            cols = slice(g.get("startColumnIndex", 0), g.get("endColumnIndex"))
+            out.append([r[cols] for r in rows])
+            self.spreadsheet.cells += sum(map(len, out[-1]))
+        return out
+
+    def batch_update(self, data, **kwargs):
+        self.spreadsheet.wait()
+        for d in data:
+            r, c = a1_to_rowcol(d["range"])
+            row = self.grid[r - 1]
+            row.extend([""] * (c - len(row)))
+            row[c - 1] = d["values"][0][0]
+
+class FakeSpreadsheet:
+    """整份試算表；每個請求都等待 latency 秒，模擬 Sheets API 的網路往返"""
+    def __init__(self, tables, latency=0.0):
+        self.latency, self.requests, self.cells = latency, 0, 0  # cells: 下載的儲存格數
+        self.sheets = {}
+        for name, df in tables.items(): self.update(name, df, wait=False)
+
+    def wait(self):
+        self.requests += 1
+        if self.latency: time.sleep(self.latency)
+
+    def _select_worksheet(self, worksheet):
+        if worksheet not in self.sheets: self.sheets[worksheet] = FakeWorksheet(self, len(self.sheets), [])
+        return self.sheets[worksheet]
+
+    def read(self, worksheet):
+        self.wait()
+        grid = self._select_worksheet(worksheet).grid
+        self.cells += sum(map(len, grid))
+        return pd.DataFrame(grid[1:], columns=grid[0]) if grid else pd.DataFrame()
+
+    def update(self, worksheet, data, wait=True):
+        if wait: self.wait()
+        values = data.astype(object).where(data.notna(), "").values.tolist()
+        self._select_worksheet(worksheet).grid = [[str(c) for c in data.columns]] + values
+
+    def batch_update(self, body):
+        self.wait()
+        sheets = {ws.id: ws for ws in self.sheets.values()}
+        for req in body["requests"]:
+            rng = req["deleteDimension"]["range"]
+            del sheets[rng["sheetId"]].grid[rng["startIndex"]:rng["endIndex"]]
+
+class FakeSheetsConnection(BaseConnection):
+    """取代 streamlit_gsheets.GSheetsConnection，讀寫 install_fake_sheets() 建立的 FakeSpreadsheet"""
+    spreadsheet = None
+
+    def _connect(self, **kwargs):
+        return FakeSheetsConnection.spreadsheet
+
+    @property
+    def client(self):
+        return self._instance
+
+    def read(self, worksheet, ttl=None, **kwargs):
+        return self._instance.read(worksheet)
+
+    def update(self, worksheet, data, **kwargs):
+        self._instance.update(worksheet, data)
+
+def install_fake_sheets(tables, latency=0.0):
+    """以假的 streamlit_gsheets 模組取代真實連線 (同一個程序內的 AppTest 都會用到)；回傳 FakeSpreadsheet"""
+    FakeSheetsConnection.spreadsheet = FakeSpreadsheet(tables, latency)
+    module = types.ModuleType("streamlit_gsheets")
+    module.GSheetsConnection = FakeSheetsConnection
+    sys.modules["streamlit_gsheets"] = module
+    return FakeSheetsConnection.spreadsheet
+
+def _store(label):
+    return LocalStore(os.path.join(TMP, f"{label}.db"))
+
+def _timeit(fn, repeat=1):
+    t = time.perf_counter()
+    for _ in range(repeat): fn()
+    return (time.perf_counter() - t) / repeat
+
+# --- 情境 ---
+def bench_writes():
+    """單筆新增 (逐列寫入) vs 整張覆寫，資料量 1k → 100k"""
+    print("== writes: 單筆新增 vs 整張覆寫 ==")
+    print(f"{'sheet':<14}{'rows':>8}{'append (ms)':>14}{'update (ms)':>14}{'rewrite (ms)':>15}")
+    for name, make in (("sales", make_sales), ("interactions", make_interactions)):
+        for n in (1_000, 10_000, 100_000):
+            store = _store(f"writes-{name}-{n}")
+            store.write(name, make(n))
+            nxt = iter(range(n + 1, n + 1000))
+            append = _timeit(lambda: store.append(name, make(1, next(nxt))), repeat=50)
+            update = _timeit(lambda: store.update(name, n // 2, {"client_id": 1}), repeat=50)
+            df = store.read(name)
+            rewrite = _timeit(lambda: store.write(name, df))
+            print(f"{name:<14}{n:>8}{append * 1000:>14.2f}{update * 1000:>14.2f}{rewrite * 1000:>15.1f}")
+
+def bench_search():
+    """客戶搜尋索引：建立時間與查詢延遲 (50k 客戶)"""
+    print("== search: 客戶搜尋索引 (50k 客戶) ==")
+    df = make_clients(50_000)
+    index = ClientSearchIndex()
+    print(f"build: {_timeit(lambda: index.build(df)) * 1000:.0f} ms")
+    for q in ("張吳公司123", "公司4999", "client4242@", "0912", "12345678", "專案17"):
+        hits = index.search(q)
+        ms = _timeit(lambda: index.search(q, limit=50), repeat=20) * 1000
+        print(f"{q:<16}{len(hits):>8} hits{ms:>10.3f} ms")
+    base = _timeit(lambda: df[df['name'].astype(str).str.contains("公司4999") | df['phone'].astype(str).str.contains("公司4999")], repeat=5)
+    print(f"pandas str.contains 全表掃描: {base * 1000:.1f} ms")
+
+def bench_report():
+    """業績彙總：重新合併 / groupby vs 彙總索引查詢 (100k 銷售)"""
+    print("== report: 業績彙總 (100k 銷售) ==")
+    sales = make_sales(100_000)
+    def rescan():
+        m = sales.copy()
+        m['date'] = pd.to_datetime(m['transaction_date'])
+        m['Month'] = m['date'].dt.strftime('%Y-%m')
+        return m[m['Month'] == "2024-03"].groupby('created_by')['sale_amount'].sum()
+    rollup = SalesRollup()
+    print(f"每次重新計算 (to_datetime + groupby): {_timeit(rescan, repeat=3) * 1000:.1f} ms")
+    print(f"彙總索引建立 (每個程序一次): {_timeit(lambda: rollup.build(sales)) * 1000:.0f} ms")
+    print(f"月排行: {_timeit(lambda: rollup.rank('2024-03'), repeat=100) * 1000:.3f} ms")
+    print(f"區間合計: {_timeit(lambda: rollup.range_total('2024-02-10', '2024-08-20'), repeat=100) * 1000:.3f} ms")
+    row = make_sales(1, 100_001).to_dict("records")
+    print(f"增量新增一筆 + 區間合計: {_timeit(lambda: (rollup.apply('sales', 'append', row), rollup.range_total('2024-02-10', '2024-08-20')), repeat=100) * 1000:.3f} ms")
+
+def bench_memory():
+    """型別化資料表：載入時轉型一次的記憶體用量與每次渲染的轉型成本"""
+    print("== memory: 未轉型 vs SCHEMAS 轉型 (100k 列) ==")
+    print(f"{'sheet':<14}{'raw (MB)':>10}{'typed (MB)':>12}{'coerce (ms)':>13}{'per-render to_numeric (ms)':>28}")
+    for name, make in (("clients", make_clients), ("sales", make_sales), ("interactions", make_interactions)):
+        store = _store(f"memory-{name}")
+        store.write(name, make(100_000))
+        raw = store.read(name)
+        typed = coerce(name, raw.copy())
+        ms = _timeit(lambda: coerce(name, raw.copy())) * 1000
+        col = "id" if name == "clients" else "client_id"
+        per_render = _timeit(lambda: pd.to_numeric(raw[col].astype(object), errors='coerce'), repeat=5) * 1000
+        mb = lambda df: df.memory_usage(deep=True).sum() / 2**20
+        print(f"{name:<14}{mb(raw):>10.1f}{mb(typed):>12.1f}{ms:>13.0f}{per_render:>28.1f}")
+
+def bench_concurrency(sessions=16, inserts=50):
+    """多個 session 同時新增：序號配發 vs 舊的 MAX(id)+1，檢查重複 id 與遺失的資料列"""
+    print(f"== concurrency: {sessions} sessions x {inserts} 筆同時新增 ==")
+    def run(label, insert):
+        path = os.path.join(TMP, f"concurrency-{label}.db")
+        LocalStore(path)
+        barrier = threading.Barrier(sessions)
+        def session():
+            store = LocalStore(path)  # 每個 session 各自連線，模擬不同使用者
+            barrier.wait()
+            for _ in range(inserts): insert(store)
+        threads = [threading.Thread(target=session) for _ in range(sessions)]
+        t = time.perf_counter()
+        for th in threads: th.start()
+        for th in threads: th.join()
+        elapsed = time.perf_counter() - t
+        rows = LocalStore(path).read("sales")
+        lost, dup = sessions * inserts - len(rows), int(rows['id'].duplicated().sum())
+        print(f"{label:<10} rows {len(rows):>6}  duplicate ids {dup:>4}  lost {lost:>5}  {elapsed:.2f} s")
+        return lost, dup
+
+    def allocated(store):
+        store.append("sales", make_sales(1, store.allocate_ids("sales")[0]))
+    def legacy(store):
+        with store._tx() as db:
+            next_id = db.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM "sales"').fetchone()[0]
+        time.sleep(0.001)  # 模擬讀取到寫入之間的網路延遲
+        store.write("sales", pd.concat([store.read("sales"), make_sales(1, next_id)]))
+    assert run("allocator", allocated) == (0, 0), "序號配發不應遺失資料列或產生重複 id"
+    run("max+1", legacy)
+
+def bench_login(threads=4):
+    """登入：帳號索引 vs 整張 users 篩選，以及 PBKDF2 次數對延遲 / 吞吐量的影響"""
+    print("== login: 帳號查詢與密碼雜湊成本 ==")
+    users = coerce("users", make_users(1_000))
+    index = UserIndex()
+    index.build(users)
+    scan = _timeit(lambda: users[users['username'] == "op500"].iloc[0], repeat=100)
+    print(f"帳號查詢 (1k 帳號): 索引 {_timeit(lambda: index.get('op500'), repeat=1000) * 1e6:.1f} µs，整表篩選 {scan * 1e6:.0f} µs")
+    print(f"{'iterations':>12}{'latency (ms)':>14}{f'logins/s ({threads} threads)':>24}")
+    for iterations in (100_000, 310_000, 600_000, 1_000_000):
+        stored = hash_password("secret", iterations=iterations)
+        latency = _timeit(lambda: check_password("secret", stored), repeat=5)
+        n = threads * 4
+        def worker():
+            for _ in range(4): check_password("secret", stored)
+        pool = [threading.Thread(target=worker) for _ in range(threads)]
+        t = time.perf_counter()
+        for th in pool: th.start()
+        for th in pool: th.join()
+        mark = "  ← PASSWORD_ITERATIONS" if iterations == crm_app.PASSWORD_ITERATIONS else ""
+        print(f"{iterations:>12,}{latency * 1000:>14.0f}{n / (time.perf_counter() - t):>24.1f}{mark}")
+
+def bench_import(n=100_000):
+    """批次匯入：100k 筆銷售 CSV 的匯入時間與尖峰記憶體，以及分批匯出"""
+    print(f"== import: {n:,} 筆銷售 CSV 匯入 / 匯出 ==")
+    store = crm_app.get_store()
+    store.write("clients", make_clients(5000))
+    path = os.path.join(TMP, "import-sales.csv")
+    make_sales(n).drop(columns=["id", "created_by"]).to_csv(path, index=False)
+    print(f"CSV 大小: {os.path.getsize(path) / 2**20:.1f} MB")
+    t = time.perf_counter()
+    imported, _, rejected = crm_app.import_rows("sales", path, "admin")
+    print(f"匯入 {imported:,} 筆 (拒絕 {rejected})，{time.perf_counter() - t:.2f} s")
+    tracemalloc.start()  # 追蹤記憶體會拖慢速度，所以另外再匯入一次量尖峰
+    crm_app.import_rows("sales", path, "admin")
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f"匯入尖峰記憶體: {peak / 2**20:.1f} MB (每批 {crm_app.IMPORT_CHUNK_ROWS:,} 列)")
+    t = time.perf_counter()
+    with crm_app.export_csv("sales") as f: size = f.seek(0, os.SEEK_END)
+    print(f"匯出 {store.count('sales'):,} 筆: {time.perf_counter() - t:.2f} s，{size / 2**20:.1f} MB")
+    tracemalloc.start()
+    crm_app.export_csv("sales").close()
+    print(f"匯出尖峰記憶體: {tracemalloc.get_traced_memory()[1] / 2**20:.1f} MB")
+    tracemalloc.stop()
+
+def bench_cascade():
+    """刪除客戶連帶刪除購買 / 跟進紀錄 (單一交易)，以及清除既有孤兒資料"""
+    print("== cascade: 連帶刪除與孤兒清理 (5k 客戶、100k 銷售、100k 跟進) ==")
+    store = _store("cascade")
+    store.write("clients", make_clients(5000)); store.write("sales", make_sales(100_000)); store.write("interactions", make_interactions(100_000))
+    clients = iter(range(1, 5001))
+    ms = _timeit(lambda: store.delete("clients", [next(clients)]), repeat=50) * 1000
+    print(f"刪除一位客戶 (含 20 筆銷售、20 筆跟進): {ms:.2f} ms")
+    with store._tx() as db: db.execute('DELETE FROM "clients" WHERE id > 4500')  # 模擬舊版只刪客戶留下的孤兒
+    print(f"孤兒資料: {store.orphans()}")
+    t = time.perf_counter()
+    deleted = store.compact_orphans()
+    print(f"清除孤兒 (含 VACUUM): {time.perf_counter() - t:.2f} s，{ {t: len(k) for t, (_, k) in deleted.items()} }")
+    print(f"剩餘: sales {store.count('sales'):,}，interactions {store.count('interactions'):,}")
+
+def bench_owner(scale=100_000):
+    """依業務分區：操作員只讀取自己的客戶 / 銷售 / 跟進 vs 管理員讀整張表"""
+    print(f"== owner: 依業務在 SQLite 篩選 ({scale:,} 筆銷售 / 跟進，20 位業務) ==")
+    store = _store("owner")
+    for name, df in make_dataset(scale).items(): store.write(name, df)
+    print(f"{'sheet':<14}{'scope':<8}{'rows':>9}{'MB':>8}{'load (ms)':>12}")
+    for name in ("clients", "sales", "interactions"):
+        for owner in (None, "op3"):
+            cache = crm_app.TableCache()
+            ms = _timeit(lambda: cache.get(store, name, owner)) * 1000
+            df = cache.get(store, name, owner)
+            print(f"{name:<14}{owner or 'all':<8}{len(df):>9,}{df.memory_usage(deep=True).sum() / 2**20:>8.1f}{ms:>12.1f}")
+    # 實際頁面：客戶名單 / 詳細資料在程序內載入了多少資料 (各角色在獨立程序中執行)
+    print(f"{'user':<8}{'step':<20}{'time (ms)':>12}{'rows read':>12}")
+    for user in ("op0", "op3"):
+        env = dict(os.environ, CRM_DB_PATH=os.path.join(TMP, f"owner-pages-{user}.db"))
+        subprocess.run([sys.executable, "-c", f"import bench_crm; bench_crm.run_owner_pages({scale}, {user!r})"],
+                       env=env, cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
+
+def run_owner_pages(scale, user):
+    """以 AppTest 開啟客戶名單與詳細資料頁，印出耗時與自 SQLite 讀出的資料列數 (op0 為管理員)。
+    AppTest 執行的腳本有自己的一份快取與索引，這裡從 pd.read_sql_query 計算實際讀取量"""
+    from streamlit.testing.v1 import AppTest
+    install_fake_sheets(make_dataset(scale))
+    at = AppTest.from_file(os.path.abspath(crm_app.__file__), default_timeout=600)
+    at.secrets["connections"] = {"gsheets": {"private_key": "bench", "type": "service_account"}}
+    role = "admin" if user == "op0" else "operator"
+    for k, v in dict(logged_in=True, user=user, role=role).items(): at.session_state[k] = v
+    read, read_sql = [0], pd.read_sql_query
+    def counting(*args, **kwargs):
+        df = read_sql(*args, **kwargs)
+        read[0] += len(df)
+        return df
+    pd.read_sql_query = counting
+
+    def step(label, action=None):
+        if action: action()
+        read[0], t = 0, time.perf_counter()
+        at.run()
+        assert not at.exception, at.exception
+        print(f"{user:<8}{label:<20}{(time.perf_counter() - t) * 1000:>12.1f}{read[0]:>12,}", flush=True)
+
+    def other_sale():
+        # 另一個 session 替別的業務 (op2) 新增一筆銷售：版本號改變，下一輪要重新讀取
+        store = LocalStore(os.environ["CRM_DB_PATH"])
+        store.append("sales", make_sales(1, start=scale + 1).assign(id=store.allocate_ids("sales")[0], client_id=2))
+
+    step("首次載入 (含匯入)")
+    step("客戶名單 (warm)")
+    step("他人新增銷售後", other_sale)
+    step("客戶詳細資料", lambda: at.session_state.__setitem__("selected_client_id", 3))
+
+def bench_pull(scale=100_000, edits=20):
+    """拉回試算表上的外部修改：每次整表重讀 vs 只讀鍵欄 / updated_at 欄再抓變動的列
+    (假連線下載不花頻寬，ms 只反映請求次數與本機比對；實際差距看 cells)"""
+    latency = float(os.environ.get("BENCH_SHEETS_LATENCY", "0.2"))
+    print(f"== pull: {scale:,} 筆銷售，外部新增 / 修改 / 刪除各 {edits} 列，Sheets 延遲 {latency * 1000:.0f} ms ==")
+    sales = make_sales(scale, clients=scale // 5)
+    sales["updated_at"] = "2024-01-01T00:00:00"
+    sheet = install_fake_sheets({"sales": sales})
+    mirror = crm_app.SheetsMirror(FakeSheetsConnection("gsheets"))
+    store = _store("pull")
+    store.write("sales", mirror.read("sales"))
+    store.set_sync_state("sales", rows=scale, updated_at="2024-01-01T00:00:00", reconciled_at=time.time(), seen=set(store.keys("sales")))
+    worker = crm_app.SheetsSyncWorker(store, mirror, crm_app.Metrics(), lambda *a: None)
+    ws = sheet.sheets["sales"]
+    header = ws.grid[0]
+    ws.grid.extend(list(r) for r in make_sales(edits, start=scale + 1).assign(updated_at="2024-06-01T00:00:00").values.tolist())
+    for r in ws.grid[1000:1000 + edits]: r[header.index("sale_amount")], r[-1] = 1.0, "2024-06-01T00:00:00"
+    del ws.grid[5000:5000 + edits]
+    sheet.latency = latency
+    print(f"{'method':<14}{'requests':>10}{'cells':>12}{'ms':>10}")
+    for label, fn in (("full read", lambda: mirror.read("sales")), ("delta pull", lambda: worker.pull(["sales"]))):
+        requests, cells = sheet.requests, sheet.cells
+        ms = _timeit(fn) * 1000
+        print(f"{label:<14}{sheet.requests - requests:>10}{sheet.cells - cells:>12,}{ms:>10.0f}")
+    assert not worker.errors, worker.errors
+    assert store.count("sales") == scale, "新增與刪除的列數應相抵"
+
+STARTUP_SCRIPT = """
+import sys, time
+sheets = sys.argv[3] == "sheets"
+if sheets:
+    import bench_crm  # 在計時前載入 (會一併載入 streamlit / pandas)，模擬的試算表每個請求延遲 argv[4] 秒
+    sheet = bench_crm.install_fake_sheets(bench_crm.make_dataset(10_000), float(sys.argv[4]))
+t = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file(sys.argv[1], default_timeout=120)
+if sheets: at.secrets["connections"] = {"gsheets": {"private_key": "bench", "type": "service_account"}}
+if sys.argv[2] == "dashboard":
+    for k, v in dict(logged_in=True, user="admin", role="admin").items(): at.session_state[k] = v
+at.run()
+cold = time.perf_counter() - t
+warm = []
+for _ in range(5):
+    t = time.perf_counter(); at.run(); warm.append(time.perf_counter() - t)
+assert not at.exception, at.exception
+print(cold, sorted(warm)[2], sheet.requests if sheets else 0)
+"""
+
+def bench_startup():
+    """啟動 / 首次繪製：新程序第一次執行腳本 (cold) 與之後 rerun (warm) 的時間；
+    sheets 列為設定了雲端鏡像的部署情境 (模擬試算表 10k 筆，延遲由 BENCH_SHEETS_LATENCY 設定)"""
+    print("== startup: 腳本執行時間 (AppTest) ==")
+    latency = os.environ.get("BENCH_SHEETS_LATENCY", "0.2")
+    app = os.path.abspath(crm_app.__file__)
+    empty = os.path.join(TMP, "empty_app.py")  # 只有 import streamlit 的腳本，作為 AppTest 本身的開銷基準
+    with open(empty, "w") as f: f.write("import streamlit as st\nst.write('ok')\n")
+    print(f"{'page':<12}{'mirror':<8}{'cold (ms)':>12}{'warm (ms)':>12}{'requests':>10}")
+    runs = [("(baseline)", empty, "local")] + [(page, app, mode) for mode in ("local", "sheets") for page in ("login", "dashboard")]
+    for page, script, mode in runs:
+        env = dict(os.environ, CRM_DB_PATH=os.path.join(TMP, f"startup-{page}-{mode}.db"))
+        out = subprocess.run([sys.executable, "-c", STARTUP_SCRIPT, script, page, mode, latency], env=env, cwd=os.path.dirname(app),
+                             capture_output=True, text=True, check=True).stdout.split()
+        cold, warm, requests = map(float, out[-3:])
+        print(f"{page:<12}{mode:<8}{cold * 1000:>12.0f}{warm * 1000:>12.1f}{requests:>10.0f}")
+
+def _rss_mb():
+    """目前的常駐記憶體 (Linux 讀 /proc，其他平台退回尖峰值)"""
+    try:
+        with open("/proc/self/statm") as f: return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10
+
+def run_app_scenarios(scale, latency):
+    """以 AppTest 依序操作各頁面，印出每一步的耗時與記憶體 (由 bench_app 在獨立程序中呼叫)"""
+    from streamlit.testing.v1 import AppTest
+    sheet = install_fake_sheets(make_dataset(scale), latency)
+    at = AppTest.from_file(os.path.abspath(crm_app.__file__), default_timeout=600)
+    at.secrets["connections"] = {"gsheets": {"private_key": "bench", "type": "service_account"}}
+    for k, v in dict(logged_in=True, user="op0", role="admin", cal_date=pd.Timestamp("2025-03-01").date()).items():
+        at.session_state[k] = v
+
+    def step(label, action=None):
+        if action: action()
+        requests, t = sheet.requests, time.perf_counter()
+        at.run()
+        assert not at.exception, at.exception
+        print(f"{label:<22}{(time.perf_counter() - t) * 1000:>12.1f}{sheet.requests - requests:>10}{_rss_mb():>12.0f}", flush=True)
+
+    def add_sale():
+        [w for w in at.text_input if w.label == "項目"][0].input("效能測試")
+        [w for w in at.button if w.label == "➕ 新增"][0].click()
+
+    print(f"{'step':<22}{'time (ms)':>12}{'requests':>10}{'RSS (MB)':>12}")
+    step("首次載入 (自 Sheets 匯入)")
+    step("客戶名單 (warm)")
+    step("客戶搜尋", lambda: at.text_input(key="client_q").input("公司12"))
+    step("客戶詳細資料", lambda: at.session_state.__setitem__("selected_client_id", 42))
+    step("新增購買紀錄", add_sale)
+    step("業績報表", lambda: (at.session_state.__setitem__("selected_client_id", None), at.sidebar.radio[0].set_value("📊 業績報表")))
+    step("行事曆", lambda: at.sidebar.radio[0].set_value("📅 行事曆與提醒"))
+    t, store = time.perf_counter(), crm_app.get_store()
+    while store.outbox_size(): time.sleep(0.05)
+    print(f"{'背景同步送出':<22}{(time.perf_counter() - t) * 1000:>12.1f}{'':>10}{_rss_mb():>12.0f}")
+
+def bench_app():
+    """整個 app 的操作流程 (AppTest + 模擬 Sheets)：1k / 10k / 100k 筆，各在獨立程序中執行"""
+    latency = float(os.environ.get("BENCH_SHEETS_LATENCY", "0.2"))
+    scales = [int(n) for n in os.environ.get("BENCH_SCALES", "1000,10000,100000").split(",")]
+    for scale in scales:
+        print(f"== app: {scale:,} 筆銷售 / 跟進，Sheets 延遲 {latency * 1000:.0f} ms ==", flush=True)
+        env = dict(os.environ, CRM_DB_PATH=os.path.join(TMP, f"app-{scale}.db"))
+        subprocess.run([sys.executable, "-c", f"import bench_crm; bench_crm.run_app_scenarios({scale}, {latency})"],
+                       env=env, cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
+
+def run_client_list(n, flips=20):
+    """以 AppTest 在客戶名單連續換頁，從效能診斷頁讀出 render:client_list 的 p50 (由 bench_client_list 呼叫)"""
+    from streamlit.testing.v1 import AppTest
+    install_fake_sheets({"clients": make_clients(n), "sales": make_sales(n, clients=n), "interactions": make_interactions(0),
+                         "users": make_users(20), "categories": pd.DataFrame({"name": ["VIP", "一般", "潛在"]})})
+    at = AppTest.from_file(os.path.abspath(crm_app.__file__), default_timeout=600)
+    at.secrets["connections"] = {"gsheets": {"private_key": "bench", "type": "service_account"}}
+    for k, v in dict(logged_in=True, user="op0", role="admin").items(): at.session_state[k] = v
+    at.run()
+
+    def menu(label): at.sidebar.radio[0].set_value(label); at.run()
+    def button(label): [w for w in at.button if w.label == label][0].click(); at.run()
+
+    for sort in ("最新建立", "累積消費"):
+        at.selectbox(key="client_sort").set_value(sort); at.run()
+        menu("🩺 效能診斷"); button("重設統計"); menu("👥 客戶名單列表")
+        for _ in range(flips): button("下一頁 ▶")
+        assert not at.exception, at.exception
+        menu("🩺 效能診斷")
+        rows = at.dataframe[0].value
+        p50 = rows.loc[rows["區段"] == "render:client_list", "p50 (ms)"].iloc[0]
+        print(f"{n:>10,}  {sort:<8}{p50:>12.1f}", flush=True)
+        menu("👥 客戶名單列表")
+
+def bench_client_list():
+    """客戶名單換頁：排序結果快取後，每頁的繪製時間不隨客戶數增加 (5k / 50k 客戶，各在獨立程序中執行)"""
+    print("== client_list: 換頁時 render:client_list 的 p50 ==")
+    print(f"{'clients':>10}  {'sort':<8}{'p50 (ms)':>12}")
+    for n in (5_000, 50_000):
+        env = dict(os.environ, CRM_DB_PATH=os.path.join(TMP, f"client-list-{n}.db"))
+        subprocess.run([sys.executable, "-c", f"import bench_crm; bench_crm.run_client_list({n})"],
+                       env=env, cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
+
+SCENARIOS = {"writes": bench_writes, "search": bench_search, "report": bench_report, "memory": bench_memory,
+             "concurrency": bench_concurrency, "login": bench_login, "import": bench_import,
+             "startup": bench_startup, "cascade": bench_cascade, "app": bench_app,
+             "owner": bench_owner, "pull": bench_pull, "client_list": bench_client_list}
+
+if __name__ == "__main__":
+    for scenario in sys.argv[1:] or SCENARIOS:
+        SCENARIOS[scenario]()
@@ -1,516 +1,2062 @@
-import streamlit as st
-import pandas as pd
-import datetime
-import time
-import hashlib
-import calendar
-import base64
-import os
-from streamlit_gsheets import GSheetsConnection
-
-# --- 設定頁面 ---
-st.set_page_config(page_title="CAMEiDEA CRM (Cloud)", page_icon="☁️", layout="wide")
-
-# --- 1. CSS 樣式 ---
-def local_css():
-    st.markdown("""
-    <style>
-        header {visibility: hidden;}
-        .main .block-container {padding-top: 1rem; padding-bottom: 1rem;}
-        .stApp { background-color: #0b0e14; color: #ffffff; }
-        section[data-testid="stSidebar"] { background-color: #13151a; border-right: 1px solid #2d3342; }
-        
-        .stTextInput > div > div > input, .stTextArea > div > div > textarea, 
-        .stDateInput > div > div > input, .stSelectbox > div > div > div, .stNumberInput > div > div > input {
-            background-color: #13151a; color: #ffffff; border: 1px solid #2d3342; border-radius: 8px; padding: 10px;
-        }
-        
-        .stTabs [data-baseweb="tab-list"] { gap: 10px; border-bottom: 1px solid #2d3342; }
-        .stTabs [data-baseweb="tab"] {
-            height: auto; white-space: pre-wrap; background-color: transparent;
-            border-radius: 4px 4px 0 0; color: #a0aec0; padding: 8px 16px;
-        }
-        .stTabs [aria-selected="true"] {
-            background-color: #1a1d24; color: #ffffff; border-bottom: 2px solid #4D5EEE;
-        }
-
-        .client-card { background-color: #1a1d24; padding: 15px; border-radius: 10px; border: 1px solid #2d3342; margin-bottom: 10px; }
-        .role-tag { padding: 2px 8px; border-radius: 4px; font-size: 0.8em; margin-left: 5px; }
-        .role-admin { background-color: #4D5EEE; color: white; }
-        .role-op { background-color: #2d3342; color: #a0aec0; }
-        .owner-tag { font-size: 0.75em; color: #a0aec0; background-color: #13151a; padding: 2px 6px; border-radius: 4px; margin-top: 5px; display: inline-block;}
-
-        div.stButton > button[kind="primary"] {
-            background-color: #4D5EEE; color: white; border: none; border-radius: 6px; padding: 0.6rem 1rem; font-weight: 600; font-size: 1rem;
-        }
-        div.stButton > button[kind="primary"]:hover { background-color: #3b4bcc; }
-        div.stButton > button[kind="secondary"] {
-            background-color: transparent; color: #ff4b4b; border: 1px solid #ff4b4b; border-radius: 6px;
-        }
-        h1, h2, h3 { font-family: 'Inter', sans-serif; color: #ffffff; }
-        p, label { color: #a0aec0; }
-    </style>
-    """, unsafe_allow_html=True)
-
-# --- 2. Google Sheets 資料庫功能 ---
-# 警告：Google Sheets 不是即時資料庫，大量寫入可能會慢，且不適合高併發
-import streamlit as st
-from streamlit_gsheets import GSheetsConnection
-
-import streamlit as st
-from streamlit_gsheets import GSheetsConnection
-
-# 1. 讀取 secrets
-raw_secrets = st.secrets["connections"]["gsheets"]
-
-# 2. 修正 private_key 的換行問題，並放入新的字典
-secrets_dict = {
-    **raw_secrets,
-    "private_key": raw_secrets["private_key"].replace("\\n", "\n") 
-}
-
-# 3. 【關鍵修正】刪除會導致衝突的 "type" 欄位
-if "type" in secrets_dict:
-    del secrets_dict["type"]
-
-# 4. 建立連線
-conn = st.connection("gsheets", type=GSheetsConnection, **secrets_dict)
-
-def get_data(worksheet_name):
-    """讀取某個分頁的所有資料"""
-    # ttl=0 代表不快取，每次都重新抓取，確保資料最新
-    try:
-        df = conn.read(worksheet=worksheet_name, ttl=0)
-        return df
-    except Exception as e:
-        st.error(f"讀取 {worksheet_name} 失敗: {e}")
-        return pd.DataFrame()
-
-def save_data(worksheet_name, df):
-    """將 DataFrame 寫回分頁 (覆蓋模式)"""
-    try:
-        conn.update(worksheet=worksheet_name, data=df)
-        st.toast(f"已同步至雲端: {worksheet_name}")
-    except Exception as e:
-        st.error(f"寫入 {worksheet_name} 失敗: {e}")
-
-def get_next_id(df):
-    """產生新的 ID (模擬 Auto Increment)"""
-    if df.empty or 'id' not in df.columns:
-        return 1
-    # 確保 id 是數值型別
-    df['id'] = pd.to_numeric(df['id'], errors='coerce').fillna(0)
-    return int(df['id'].max()) + 1
-
-def hash_password(password): return hashlib.sha256(str.encode(password)).hexdigest()
-
-def verify_user(username, password):
-    df = get_data("users")
-    if df.empty: return False, None, None
-    
-    user_row = df[df['username'] == username]
-    if not user_row.empty:
-        stored_pw = user_row.iloc[0]['password']
-        if stored_pw == hash_password(password):
-            return True, user_row.iloc[0]['role'], user_row.iloc[0]['sales_name']
-    return False, None, None
-
-def create_user(username, password, name, role='operator'):
-    df = get_data("users")
-    if not df.empty and username in df['username'].values:
-        return False
-    
-    new_row = pd.DataFrame([{
-        "username": username,
-        "password": hash_password(password),
-        "role": role,
-        "sales_name": name
-    }])
-    df = pd.concat([df, new_row], ignore_index=True)
-    save_data("users", df)
-    return True
-
-def get_img_as_base64(file):
-    if not os.path.exists(file): return None
-    try:
-        with open(file, "rb") as f: data = f.read()
-        return base64.b64encode(data).decode()
-    except: return None
-
-# --- 3. 頁面功能 ---
-
-def page_login_register():
-    st.markdown("<br><br><br>", unsafe_allow_html=True)
-    c_left, c_right = st.columns([2, 3], gap="large")
-    
-    img_path = "png-02.png" 
-    img_base64 = get_img_as_base64(img_path)
-
-    with c_left:
-        st.markdown("""<div style='display: flex; flex-direction: column; justify-content: center; align-items: center; height: 100%;'>""", unsafe_allow_html=True)
-        if img_base64:
-            st.markdown(f'<img src="data:image/png;base64,{img_base64}" style="max-width: 280px;">', unsafe_allow_html=True)
-        else:
-            st.markdown("<h1>☁️ CRM</h1>", unsafe_allow_html=True)
-        st.markdown("</div>", unsafe_allow_html=True)
-
-    with c_right:
-        st.markdown("<br>", unsafe_allow_html=True)
-        tab1, tab2 = st.tabs(["登入", "註冊 (操作員)"])
-        
-        with tab1:
-            with st.form("login_form"):
-                u = st.text_input("帳號", key="login_u")
-                p = st.text_input("密碼", type="password", key="login_p")
-                if st.form_submit_button("登入", type="primary", use_container_width=True):
-                    is_valid, role, s_name = verify_user(u, p)
-                    if is_valid:
-                        st.session_state['logged_in'] = True
-                        st.session_state['user'] = u
-                        st.session_state['role'] = role
-                        st.session_state['real_name'] = s_name
-                        st.rerun()
-                    else: st.error("帳號或密碼錯誤")
-        
-        with tab2:
-            with st.form("reg"):
-                nu = st.text_input("設定帳號")
-                nn = st.text_input("業務姓名 (顯示名稱)")
-                np = st.text_input("設定密碼", type="password")
-                if st.form_submit_button("註冊", type="primary", use_container_width=True):
-                    if len(nu)>0 and len(np)>0 and len(nn)>0:
-                        if create_user(nu, np, nn, 'operator'): 
-                            st.success(f"註冊成功！歡迎 {nn}，請重新登入。")
-                            time.sleep(1); st.rerun()
-                        else: st.error("帳號已存在")
-                    else: st.error("所有欄位皆為必填")
-
-def render_client_detail(client_id):
-    # 讀取所有需要的資料
-    df_clients = get_data("clients")
-    # 確保 ID 格式一致
-    df_clients['id'] = pd.to_numeric(df_clients['id'], errors='coerce')
-    client_row = df_clients[df_clients['id'] == client_id]
-
-    if client_row.empty: st.session_state['selected_client_id'] = None; st.rerun(); return
-    
-    # 轉成 dict 方便使用
-    c_data = client_row.iloc[0].to_dict()
-    
-    user_role = st.session_state.get('role', 'operator')
-    current_user = st.session_state.get('user')
-    
-    if user_role != 'admin' and c_data['created_by'] != current_user:
-        st.error("⛔ 您沒有權限查看此客戶資料。")
-        if st.button("返回"): st.session_state['selected_client_id'] = None; st.rerun()
-        return
-
-    if st.button("⬅️ 返回客戶列表"):
-        st.session_state['selected_client_id'] = None
-        st.rerun()
-
-    df_cats = get_data("categories")
-    cats = df_cats['name'].tolist() if not df_cats.empty else []
-    
-    # 計算累積消費
-    df_sales = get_data("sales")
-    df_sales['client_id'] = pd.to_numeric(df_sales['client_id'], errors='coerce')
-    client_sales = df_sales[df_sales['client_id'] == client_id].copy()
-    total_spent = client_sales['sale_amount'].sum() if not client_sales.empty else 0
-
-    st.markdown(f"### 👤 {c_data['name']} <span style='font-size:0.6em; color:#a0aec0'>(累積消費: ${total_spent:,.0f})</span>", unsafe_allow_html=True)
-    
-    with st.expander("✏️ 編輯基本資料"):
-        with st.form("edit_client"):
-            c1, c2, c3 = st.columns(3)
-            with c1:
-                nn = st.text_input("名稱", value=c_data['name'])
-                nph = st.text_input("電話", value=c_data['phone'])
-                nem = st.text_input("Email", value=c_data['email'])
-            with c2:
-                ncat = st.selectbox("分類", cats, index=cats.index(c_data['category']) if c_data['category'] in cats else 0)
-                nproj = st.text_input("專案", value=c_data['project'])
-            with c3:
-                ntitle = st.text_input("抬頭 (Title)", value=c_data['title'])
-                ninv = st.text_input("統編 (Tax ID)", value=c_data['invoice_number'])
-            
-            if st.form_submit_button("💾 更新資料", type="primary"):
-                # 更新 DataFrame
-                df_clients.loc[df_clients['id'] == client_id, ['name', 'phone', 'email', 'category', 'project', 'title', 'invoice_number']] = [nn, nph, nem, ncat, nproj, ntitle, ninv]
-                save_data("clients", df_clients)
-                st.success("已更新"); time.sleep(0.5); st.rerun()
-
-    st.markdown("---")
-    t1, t2, t3 = st.tabs(["💰 購買紀錄", "📝 跟進紀錄", "🕒 歷史紀錄"])
-    
-    with t1:
-        # 顯示購買紀錄
-        if not client_sales.empty:
-            client_sales = client_sales.sort_values('transaction_date', ascending=False)
-        
-        if user_role == 'admin':
-            st.info("➕ 新增購買紀錄")
-            sales_owner = c_data['created_by']
-            st.caption(f"ℹ️ 業績歸屬：**{sales_owner}**")
-            with st.form("add_sale"):
-                c1, c2, c3 = st.columns([2,3,2])
-                sd = c1.date_input("日期", datetime.date.today())
-                si = c2.text_input("項目")
-                sinv = c2.text_input("發票")
-                sa = c3.number_input("金額", min_value=0)
-                if st.form_submit_button("➕ 新增", type="primary"):
-                    if si:
-                        new_sale = pd.DataFrame([{
-                            "id": get_next_id(df_sales),
-                            "client_id": client_id,
-                            "transaction_date": sd.strftime("%Y-%m-%d"),
-                            "item_name": si,
-                            "invoice_number": sinv,
-                            "sale_amount": sa,
-                            "created_by": sales_owner
-                        }])
-                        df_sales = pd.concat([df_sales, new_sale], ignore_index=True)
-                        save_data("sales", df_sales)
-                        st.success("已新增"); time.sleep(0.5); st.rerun()
-                    else: st.error("請輸入項目")
-        else: st.warning("🔒 僅管理員可新增")
-
-        if not client_sales.empty:
-            for idx, row in client_sales.iterrows():
-                with st.container():
-                    cols = st.columns([2, 3, 2, 2])
-                    cols[0].write(row['transaction_date'])
-                    cols[1].write(f"**{row['item_name']}**")
-                    cols[2].write(f"發票: {row['invoice_number']}")
-                    cols[3].write(f"${row['sale_amount']:,.0f}")
-                    st.markdown("<hr style='margin:5px 0; border-color:#2d3342'>", unsafe_allow_html=True)
-
-    with t2:
-        with st.form("add_inter"):
-            c1, c2 = st.columns(2)
-            ld = c1.date_input("日期", datetime.date.today())
-            fd = c2.date_input("提醒日", datetime.date.today()+datetime.timedelta(days=3))
-            cnt = st.text_area("內容")
-            rem = st.text_input("提醒")
-            if st.form_submit_button("💾 儲存", type="primary"):
-                df_inter = get_data("interactions")
-                if cnt or rem:
-                    new_inter = pd.DataFrame([{
-                        "id": get_next_id(df_inter),
-                        "client_id": client_id,
-                        "log_date": ld.strftime("%Y-%m-%d"),
-                        "content": cnt,
-                        "follow_up_date": fd.strftime("%Y-%m-%d"),
-                        "reminder_note": rem,
-                        "updated_by": st.session_state['user']
-                    }])
-                    df_inter = pd.concat([df_inter, new_inter], ignore_index=True)
-                    save_data("interactions", df_inter)
-                    st.success("已儲存"); time.sleep(0.5); st.rerun()
-                else: st.error("需填寫內容")
-
-    with t3:
-        df_inter = get_data("interactions")
-        if not df_inter.empty:
-            df_inter['client_id'] = pd.to_numeric(df_inter['client_id'], errors='coerce')
-            c_inter = df_inter[df_inter['client_id'] == client_id].sort_values('log_date', ascending=False)
-            st.dataframe(c_inter[['log_date','content','follow_up_date','reminder_note','updated_by']], use_container_width=True, hide_index=True)
-
-    st.markdown("<br>", unsafe_allow_html=True)
-    with st.expander("🗑️ 刪除客戶"):
-        if user_role == 'admin':
-            if st.button("確認永久刪除", type="secondary"):
-                # 刪除客戶與相關資料
-                df_clients = df_clients[df_clients['id'] != client_id]
-                save_data("clients", df_clients)
-                # 這裡為了效能，可以選擇不刪除關聯資料，或者如下同步刪除
-                df_sales = df_sales[df_sales['client_id'] != client_id]
-                save_data("sales", df_sales)
-                st.session_state['selected_client_id'] = None; st.rerun()
-
-def render_add_client():
-    st.title("➕ 新增客戶")
-    df_cats = get_data("categories")
-    cats = df_cats['name'].tolist() if not df_cats.empty else []
-    
-    with st.form("new_c"):
-        c1, c2 = st.columns(2)
-        n = c1.text_input("名稱 (必填)")
-        p = c1.text_input("電話")
-        e = c1.text_input("Email")
-        cat = c1.selectbox("分類", cats)
-        proj = c2.text_input("合作項目")
-        title = c2.text_input("抬頭")
-        inv = c2.text_input("統編")
-        if st.form_submit_button("🚀 建立", type="primary"):
-            if n:
-                df_clients = get_data("clients")
-                # 檢查重複電話 (選用)
-                if not df_clients.empty and p and str(p) in df_clients['phone'].astype(str).values:
-                    st.warning("此電話號碼已存在")
-                else:
-                    new_id = get_next_id(df_clients)
-                    new_client = pd.DataFrame([{
-                        "id": new_id,
-                        "name": n, "phone": str(p), "email": e, "project": proj,
-                        "title": title, "invoice_number": str(inv), "category": cat,
-                        "created_at": datetime.datetime.now().strftime("%Y-%m-%d"),
-                        "created_by": st.session_state['user']
-                    }])
-                    df_clients = pd.concat([df_clients, new_client], ignore_index=True)
-                    save_data("clients", df_clients)
-                    st.success("成功"); time.sleep(1)
-            else: st.error("名稱必填")
-
-def render_report():
-    st.title("📊 業績報表 (Google Sheets)")
-    
-    # 讀取資料並合併 (Pandas Join)
-    df_sales = get_data("sales")
-    df_clients = get_data("clients")
-    df_users = get_data("users")
-    
-    if df_sales.empty: st.info("尚無資料"); return
-
-    # 處理型別以利合併
-    df_sales['client_id'] = pd.to_numeric(df_sales['client_id'], errors='coerce')
-    df_clients['id'] = pd.to_numeric(df_clients['id'], errors='coerce')
-    
-    # Merge Sales + Clients
-    merged = pd.merge(df_sales, df_clients[['id', 'name']], left_on='client_id', right_on='id', how='left')
-    # Merge + Users (取得 sales_name)
-    merged = pd.merge(merged, df_users[['username', 'sales_name']], left_on='created_by', right_on='username', how='left')
-    
-    merged['sales_name'] = merged['sales_name'].fillna(merged['created_by'])
-    merged['date'] = pd.to_datetime(merged['transaction_date'])
-    merged['Month'] = merged['date'].dt.strftime('%Y-%m')
-    merged['Year'] = merged['date'].dt.strftime('%Y')
-
-    unique_users = sorted(merged['sales_name'].unique().tolist())
-    users = ["🏢 全公司總覽"] + unique_users
-    selected_user = st.selectbox("檢視對象", users)
-    display_df = merged if selected_user == "🏢 全公司總覽" else merged[merged['sales_name'] == selected_user]
-
-    # 排行榜
-    if selected_user == "🏢 全公司總覽":
-        c1, c2 = st.columns(2)
-        with c1:
-            st.markdown("##### 本月排行")
-            this_month = datetime.datetime.now().strftime('%Y-%m')
-            rank = merged[merged['Month']==this_month].groupby('sales_name')['sale_amount'].sum().sort_values(ascending=False)
-            if not rank.empty: st.bar_chart(rank)
-        with c2:
-            st.markdown("##### 本年排行")
-            this_year = datetime.datetime.now().strftime('%Y')
-            rank_y = merged[merged['Year']==this_year].groupby('sales_name')['sale_amount'].sum().sort_values(ascending=False)
-            if not rank_y.empty: st.bar_chart(rank_y)
-
-    total = display_df['sale_amount'].sum()
-    st.metric("總業績", f"${total:,.0f}")
-    
-    st.dataframe(display_df[['transaction_date','name','item_name','sale_amount','sales_name']], use_container_width=True)
-
-def render_calendar():
-    st.title("📅 行事曆")
-    df_inter = get_data("interactions")
-    df_clients = get_data("clients")
-    
-    if df_inter.empty: st.info("無待辦"); return
-
-    df_inter['client_id'] = pd.to_numeric(df_inter['client_id'], errors='coerce')
-    df_clients['id'] = pd.to_numeric(df_clients['id'], errors='coerce')
-    
-    # Join
-    merged = pd.merge(df_inter, df_clients[['id', 'name', 'created_by']], left_on='client_id', right_on='id', how='left')
-    
-    # 權限過濾
-    if st.session_state['role'] != 'admin':
-        merged = merged[merged['created_by'] == st.session_state['user']]
-    
-    # 只顯示有提醒日的
-    merged = merged[merged['follow_up_date'].notna()]
-    
-    if 'cal_date' not in st.session_state: st.session_state['cal_date'] = datetime.date.today()
-    
-    c1, c2 = st.columns([4, 3])
-    with c1:
-        sel = st.date_input("選擇日期", st.session_state['cal_date'])
-        if sel != st.session_state['cal_date']:
-            st.session_state['cal_date'] = sel; st.rerun()
-            
-    with c2:
-        target_date = st.session_state['cal_date'].strftime("%Y-%m-%d")
-        tasks = merged[merged['follow_up_date'] == target_date]
-        st.subheader(f"{target_date} 待辦")
-        if not tasks.empty:
-            for _, r in tasks.iterrows():
-                st.info(f"客戶: {r['name']} | 事項: {r['reminder_note']}")
-        else: st.caption("無事項")
-
-def page_dashboard():
-    local_css()
-    role = st.session_state.get('role', 'operator')
-    real_name = st.session_state.get('real_name', st.session_state['user'])
-    options = ["👥 客戶名單列表", "➕ 新增客戶", "📅 行事曆與提醒"]
-    if role == 'admin': options.append("📊 業績報表")
-    
-    if 'current_view' not in st.session_state: st.session_state['current_view'] = options[0]
-
-    with st.sidebar:
-        st.title(f"Hi, {real_name}")
-        st.caption(f"身分: {role}")
-        selected = st.radio("選單", options)
-        if selected != st.session_state['current_view']:
-            st.session_state['current_view'] = selected
-            st.session_state['selected_client_id'] = None
-            st.rerun()
-        if st.button("登出"): st.session_state['logged_in'] = False; st.rerun()
-
-    menu = st.session_state['current_view']
-    
-    if st.session_state.get('selected_client_id'):
-        render_client_detail(st.session_state['selected_client_id']); return
-
-    if menu == "👥 客戶名單列表":
-        st.title("👥 客戶名單")
-        q = st.text_input("🔍 搜尋")
-        
-        df_clients = get_data("clients")
-        df_users = get_data("users")
-        
-        # 權限過濾
-        if role != 'admin':
-            df_clients = df_clients[df_clients['created_by'] == st.session_state['user']]
-            
-        # Join User Name
-        if not df_clients.empty:
-            df_clients = pd.merge(df_clients, df_users[['username', 'sales_name']], left_on='created_by', right_on='username', how='left')
-            df_clients['sales_name'] = df_clients['sales_name'].fillna('Unknown')
-        
-        if q and not df_clients.empty:
-            df_clients = df_clients[df_clients['name'].astype(str).str.contains(q) | df_clients['phone'].astype(str).str.contains(q)]
-            
-        if not df_clients.empty:
-            for _, row in df_clients.iterrows():
-                with st.container():
-                    c1, c2, c3, c4 = st.columns([2, 2, 2, 1])
-                    c1.markdown(f"**{row['name']}**")
-                    c2.text(f"📞 {row['phone']}")
-                    c3.markdown(f"<span class='owner-tag'>{row['sales_name']}</span>", unsafe_allow_html=True)
-                    if c4.button("查看", key=f"v_{row['id']}"):
-                        st.session_state['selected_client_id'] = row['id']; st.rerun()
-                    st.markdown("<hr>", unsafe_allow_html=True)
-        else: st.info("無資料")
-        
-    elif menu == "➕ 新增客戶": render_add_client()
-    elif menu == "📅 行事曆與提醒": render_calendar()
-    elif menu == "📊 業績報表": render_report()
-
-def main():
-    if 'logged_in' not in st.session_state: st.session_state['logged_in'] = False
-    if not st.session_state['logged_in']: local_css(); page_login_register()
-    else: page_dashboard()
-
-
-if __name__ == "__main__": main()
-
+import streamlit as st
+import pandas as pd
+import datetime
+import time
+import hashlib
+import hmac
+import json
+import calendar
+import base64
+import codecs
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+from bisect import bisect_left, bisect_right, insort
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from itertools import accumulate
+
+# --- 設定頁面 ---
+st.set_page_config(page_title="CAMEiDEA CRM (Cloud)", page_icon="☁️", layout="wide")
+
+# --- 1. CSS 樣式 ---
+# 樣式表在匯入時組好一次；Streamlit 每次 rerun 都會清掉上一輪的元素，所以每輪仍要送出一次
+CSS = """
+    <style>
+        header {visibility: hidden;}
+        .main .block-container {padding-top: 1rem; padding-bottom: 1rem;}
+        .stApp { background-color: #0b0e14; color: #ffffff; }
+        section[data-testid="stSidebar"] { background-color: #13151a; border-right: 1px solid #2d3342; }
+        
+        .stTextInput > div > div > input, .stTextArea > div > div > textarea, 
+        .stDateInput > div > div > input, .stSelectbox > div > div > div, .stNumberInput > div > div > input {
+            background-color: #13151a; color: #ffffff; border: 1px solid #2d3342; border-radius: 8px; padding: 10px;
+        }
+        
+        .stTabs [data-baseweb="tab-list"] { gap: 10px; border-bottom: 1px solid #2d3342; }
+        .stTabs [data-baseweb="tab"] {
+            height: auto; white-space: pre-wrap; background-color: transparent;
+            border-radius: 4px 4px 0 0; color: #a0aec0; padding: 8px 16px;
+        }
+        .stTabs [aria-selected="true"] {
+            background-color: #1a1d24; color: #ffffff; border-bottom: 2px solid #4D5EEE;
+        }
+
+        .client-card { background-color: #1a1d24; padding: 15px; border-radius: 10px; border: 1px solid #2d3342; margin-bottom: 10px; }
+        .role-tag { padding: 2px 8px; border-radius: 4px; font-size: 0.8em; margin-left: 5px; }
+        .role-admin { background-color: #4D5EEE; color: white; }
+        .role-op { background-color: #2d3342; color: #a0aec0; }
+        .owner-tag { font-size: 0.75em; color: #a0aec0; background-color: #13151a; padding: 2px 6px; border-radius: 4px; margin-top: 5px; display: inline-block;}
+
+        div.stButton > button[kind="primary"] {
+            background-color: #4D5EEE; color: white; border: none; border-radius: 6px; padding: 0.6rem 1rem; font-weight: 600; font-size: 1rem;
+        }
+        div.stButton > button[kind="primary"]:hover { background-color: #3b4bcc; }
+        div.stButton > button[kind="secondary"] {
+            background-color: transparent; color: #ff4b4b; border: 1px solid #ff4b4b; border-radius: 6px;
+        }
+        h1, h2, h3 { font-family: 'Inter', sans-serif; color: #ffffff; }
+        p, label { color: #a0aec0; }
+    </style>
+    """
+
+def local_css():
+    st.markdown(CSS, unsafe_allow_html=True)
+
+# --- 2. 資料儲存層 ---
+# 本機 SQLite 為主要資料庫 (讀寫都在本機磁碟完成)，Google Sheets 改為選用的非同步鏡像
+DB_PATH = os.environ.get("CRM_DB_PATH", "crm.db")
+# 背景同步：沒有新變更時多久檢查一次 _outbox，以及重試的最長間隔 (秒)
+SYNC_POLL_SECONDS = 5
+SYNC_MAX_BACKOFF = 300
+SYNC_BATCH_ROWS = 5000
+# 從試算表拉回直接修改的資料：每隔多久比對一次主鍵欄，多久整張比對一次 (抓出沒有 updated_at 欄時的修改)
+SYNC_PULL_SECONDS = 60
+SYNC_RECONCILE_SECONDS = 3600
+# 試算表若有這一欄 (例如由 Apps Script 在編輯時寫入)，拉回時只下載時間戳記比上次新的列
+SYNC_UPDATED_AT = "updated_at"
+# 一次拉回的修改超過這個筆數時，改為讓索引整個重建
+SYNC_PULL_MAX_UPDATES = 100
+# 效能量測：每個 (頁面, 區段) 保留最近幾筆耗時來計算 p50 / p95
+METRIC_SAMPLES = 500
+
+# 各分頁的主鍵與欄位 (SQLite 欄位型別)
+TABLES = {
+    "clients": ("id", {
+        "id": "INTEGER", "name": "TEXT", "phone": "TEXT", "email": "TEXT", "project": "TEXT",
+        "title": "TEXT", "invoice_number": "TEXT", "category": "TEXT",
+        "created_at": "TEXT", "created_by": "TEXT", "row_version": "INTEGER"}),
+    "sales": ("id", {
+        "id": "INTEGER", "client_id": "INTEGER", "transaction_date": "TEXT", "item_name": "TEXT",
+        "invoice_number": "TEXT", "sale_amount": "REAL", "created_by": "TEXT"}),
+    "interactions": ("id", {
+        "id": "INTEGER", "client_id": "INTEGER", "log_date": "TEXT", "content": "TEXT",
+        "follow_up_date": "TEXT", "reminder_note": "TEXT", "updated_by": "TEXT"}),
+    "users": ("username", {"username": "TEXT", "password": "TEXT", "role": "TEXT", "sales_name": "TEXT"}),
+    "categories": ("name", {"name": "TEXT"}),
+}
+# 有這個欄位的資料表，每次更新都會 +1；帶著讀取時的版本寫入即可偵測別人是否先改過 (樂觀鎖)
+ROW_VERSION = "row_version"
+# 參照關係: 主表 → [(子表, 外鍵欄位)]；刪除主表資料列時一併刪除子表的相關資料
+REFERENCES = {"clients": [("sales", "client_id"), ("interactions", "client_id")]}
+# 負責業務欄位：操作員只讀取自己的客戶，以及透過 REFERENCES 參照這些客戶的子表資料
+OWNER_COLUMN = ("clients", "created_by")
+
+def _owner_filter(name):
+    """依負責業務篩選的 SQL 條件 (參數為業務帳號)；資料表不分業務時回傳 None"""
+    parent, col = OWNER_COLUMN
+    if name == parent: return f'"{col}" = ?'
+    for child, fk in REFERENCES[parent]:
+        if child == name: return f'"{fk}" IN (SELECT "{TABLES[parent][0]}" FROM "{parent}" WHERE "{col}" = ?)'
+    return None
+
+def _owner_tables(name):
+    """依業務篩選的結果會受哪些資料表的寫入影響"""
+    return (name,) if name == OWNER_COLUMN[0] else (name, OWNER_COLUMN[0])
+
+# 各分頁載入後的 pandas 型別：id 用 Int32、重複值多的欄位用 category、日期用 datetime64
+SCHEMAS = {
+    "clients": {
+        "id": "Int32", "name": "string", "phone": "string", "email": "string", "project": "string",
+        "title": "string", "invoice_number": "string", "category": "category",
+        "created_at": "datetime64[ns]", "created_by": "category", "row_version": "Int32"},
+    "sales": {
+        "id": "Int32", "client_id": "Int32", "transaction_date": "datetime64[ns]", "item_name": "string",
+        "invoice_number": "string", "sale_amount": "float64", "created_by": "category"},
+    "interactions": {
+        "id": "Int32", "client_id": "Int32", "log_date": "datetime64[ns]", "content": "string",
+        "follow_up_date": "datetime64[ns]", "reminder_note": "string", "updated_by": "category"},
+    "users": {"username": "string", "password": "string", "role": "category", "sales_name": "string"},
+    "categories": {"name": "string"},
+}
+
+def _numbers(series):
+    """文字數字轉成數值：先去掉千分位逗號、貨幣符號與空白 ("1,500" → 1500)，無法辨識的為 NA"""
+    if not pd.api.types.is_numeric_dtype(series):
+        series = series.astype("string").str.replace(r"[,\s$]", "", regex=True)
+    return pd.to_numeric(series, errors="coerce")
+
+def _dates(series):
+    """日期欄轉成 datetime64：先以 ISO 8601 向量化解析 (本機資料都是這個格式)，
+    剩下的其他寫法 (3/6/2025 等) 再逐一辨識，不會因為第一列的格式而整欄變成 NaT"""
+    out = pd.to_datetime(series, errors="coerce", format="ISO8601")
+    if out.isna().any():
+        rest = out.isna() & series.notna() & (series.astype("string").str.strip() != "")
+        if rest.any(): out[rest] = pd.to_datetime(series[rest].astype("string"), errors="coerce", format="mixed")
+    return out
+
+def _unparsed(worksheet_name, raw, typed):
+    """原本有值、轉型後卻變成 NA 的格子 (日期 / 數字格式錯誤)：回傳每列第一個出錯的欄位 ("" 表示沒有)"""
+    bad = pd.Series("", index=typed.index)
+    for col, dtype in SCHEMAS.get(worksheet_name, {}).items():
+        if dtype in ("string", "category") or col not in raw.columns or col not in typed.columns: continue
+        filled = raw[col].notna() & (raw[col].astype("string").str.strip() != "")
+        bad = bad.mask((bad == "") & filled & typed[col].isna(), col)
+    return bad
+
+def coerce(worksheet_name, df):
+    """依 SCHEMAS 轉換欄位型別；在載入時做一次，之後各頁面不必再 to_numeric。
+    轉換失敗的格子會變成 NA，結果只供顯示與索引使用，不可再寫回資料庫 (寫入前用 _unparsed 檢查)"""
+    for col, dtype in SCHEMAS.get(worksheet_name, {}).items():
+        if col not in df.columns: continue
+        if dtype.startswith("Int"):
+            df[col] = _numbers(df[col]).round().astype(dtype)
+        elif dtype == "float64":
+            df[col] = _numbers(df[col]).astype(dtype)
+        elif dtype.startswith("datetime"):
+            df[col] = _dates(df[col])
+        else:
+            df[col] = df[col].astype(dtype)
+    return df
+
+def _value(v):
+    """numpy / pandas 純量轉成 Python 原生型別 (NaN → None)"""
+    if v is None or (not isinstance(v, str) and pd.isna(v)): return None
+    if isinstance(v, (pd.Timestamp, datetime.date)): return v.strftime("%Y-%m-%d")
+    return v.item() if hasattr(v, "item") else v
+
+def _records(df, cols):
+    """DataFrame 轉成可寫入 SQLite 的 tuple 清單 (NaN → NULL，日期轉回 'YYYY-MM-DD')"""
+    out = df.reindex(columns=cols)
+    for c in cols:
+        if pd.api.types.is_datetime64_any_dtype(out[c]): out[c] = out[c].dt.strftime("%Y-%m-%d")
+    out = out.astype(object)
+    return list(out.where(out.notna(), None).itertuples(index=False, name=None))
+
+class ConflictError(Exception):
+    """比對版本失敗：資料列在讀取之後已被其他人修改或刪除"""
+    def __init__(self, name, key, expected, current):
+        self.name, self.key, self.expected, self.current = name, key, expected, current
+        state = "已被其他人刪除" if current is None else f"已被其他人修改 (您看到的是第 {expected} 版，目前是第 {current} 版)"
+        super().__init__(f"{name} #{key} {state}，請確認最新內容後再操作")
+
+class LocalStore:
+    """本機 SQLite 資料庫，每個分頁對應一張資料表"""
+    def __init__(self, path):
+        self.path = path
+        with self._tx() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            for name, (key, cols) in TABLES.items():
+                defs = ", ".join(f'"{c}" {t}' + (" PRIMARY KEY" if c == key else "") for c, t in cols.items())
+                db.execute(f'CREATE TABLE IF NOT EXISTS "{name}" ({defs})')
+                self._columns(db, name, cols)  # 舊資料庫補上之後新增的欄位
+            # 每張資料表的版本號，任何寫入都會 +1，供讀取快取判斷是否過期
+            db.execute('CREATE TABLE IF NOT EXISTS "_versions" (name TEXT PRIMARY KEY, version INTEGER)')
+            # 每張資料表的 ID 序號 (最後一個已配發的 id)
+            db.execute('CREATE TABLE IF NOT EXISTS "_sequences" (name TEXT PRIMARY KEY, value INTEGER)')
+            # 待同步到 Google Sheets 的變更 (與本機寫入同一交易，重新啟動也不會遺失)
+            db.execute('CREATE TABLE IF NOT EXISTS "_outbox" (seq INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT, op TEXT, '
+                       'payload TEXT, attempts INTEGER DEFAULT 0, next_at REAL DEFAULT 0)')
+            # 從試算表拉回的進度 (high-water mark)：列數、最新的 updated_at、上次拉回 / 整張比對的時間，
+            # 以及上次在試算表上看到的主鍵 (JSON)；只有曾經出現在試算表、後來不見的列才算遠端刪除
+            db.execute('CREATE TABLE IF NOT EXISTS "_sync_state" (name TEXT PRIMARY KEY, rows INTEGER DEFAULT 0, '
+                       "updated_at TEXT DEFAULT '', pulled_at REAL DEFAULT 0, reconciled_at REAL DEFAULT 0, seen TEXT)")
+            if "seen" not in [r[1] for r in db.execute('PRAGMA table_info("_sync_state")')]:
+                db.execute('ALTER TABLE "_sync_state" ADD COLUMN seen TEXT')
+            # 依客戶查詢銷售 / 跟進紀錄用的索引
+            db.execute('CREATE INDEX IF NOT EXISTS "sales_client_id" ON "sales" ("client_id")')
+            db.execute('CREATE INDEX IF NOT EXISTS "interactions_client_id" ON "interactions" ("client_id")')
+            # 依負責業務篩選客戶用的索引 (操作員只讀取自己的客戶)
+            db.execute(f'CREATE INDEX IF NOT EXISTS "clients_owner" ON "{OWNER_COLUMN[0]}" ("{OWNER_COLUMN[1]}")')
+        # 有設定雲端鏡像時才記錄待同步的變更
+        self.outbox = False
+
+    @contextmanager
+    def _tx(self):
+        """開啟連線並包成一個交易 (成功 commit，例外 rollback)"""
+        db = sqlite3.connect(self.path, timeout=30)
+        try:
+            with db: yield db
+        finally: db.close()
+
+    def _columns(self, db, name, cols):
+        """補上資料表缺少的欄位 (例如雲端試算表自行新增的欄)"""
+        existing = [r[1] for r in db.execute(f'PRAGMA table_info("{name}")')]
+        for c in cols:
+            if c not in existing:
+                db.execute(f'ALTER TABLE "{name}" ADD COLUMN "{c}" {TABLES[name][1].get(c, "TEXT")}')
+                existing.append(c)
+        return existing
+
+    def _bump(self, db, name):
+        """版本號 +1 並回傳新版本 (與寫入在同一交易內)"""
+        db.execute('INSERT INTO "_versions" VALUES (?, 1) ON CONFLICT(name) DO UPDATE SET version = version + 1', (name,))
+        return db.execute('SELECT version FROM "_versions" WHERE name = ?', (name,)).fetchone()[0]
+
+    def _enqueue(self, db, name, op, payload):
+        if self.outbox:
+            db.execute('INSERT INTO "_outbox" (name, op, payload) VALUES (?, ?, ?)', (name, op, json.dumps(payload, ensure_ascii=False)))
+
+    def pending(self, limit=1000):
+        """依寫入順序取出待同步的變更"""
+        with self._tx() as db:
+            rows = db.execute('SELECT seq, name, op, payload, attempts, next_at FROM "_outbox" ORDER BY seq LIMIT ?', (limit,)).fetchall()
+        return [(seq, name, op, json.loads(payload), attempts, next_at) for seq, name, op, payload, attempts, next_at in rows]
+
+    def ack(self, seqs):
+        with self._tx() as db:
+            db.executemany('DELETE FROM "_outbox" WHERE seq = ?', [(q,) for q in seqs])
+
+    def retry_later(self, seqs, attempts, next_at):
+        with self._tx() as db:
+            db.executemany('UPDATE "_outbox" SET attempts = ?, next_at = ? WHERE seq = ?', [(attempts, next_at, q) for q in seqs])
+
+    def outbox_size(self, name=None):
+        with self._tx() as db:
+            if name is None: return db.execute('SELECT COUNT(*) FROM "_outbox"').fetchone()[0]
+            return db.execute('SELECT COUNT(*) FROM "_outbox" WHERE name = ?', (name,)).fetchone()[0]
+
+    def sync_state(self, name):
+        """拉回進度；seen 為上次在試算表上看到的主鍵集合 (還沒比對過時為 None)"""
+        with self._tx() as db:
+            row = db.execute('SELECT rows, updated_at, pulled_at, reconciled_at, seen FROM "_sync_state" WHERE name = ?', (name,)).fetchone()
+        state = dict(zip(("rows", "updated_at", "pulled_at", "reconciled_at", "seen"), row or (0, "", 0.0, 0.0, None)))
+        state["seen"] = None if state["seen"] is None else set(json.loads(state["seen"]))
+        return state
+
+    def _set_sync_state(self, db, name, values):
+        if "seen" in values: values = {**values, "seen": json.dumps(sorted(values["seen"]), ensure_ascii=False)}
+        sets = ", ".join(f'"{c}" = excluded."{c}"' for c in values)
+        cols = ", ".join(["name"] + [f'"{c}"' for c in values])
+        db.execute(f'INSERT INTO "_sync_state" ({cols}) VALUES ({", ".join("?" * (len(values) + 1))}) '
+                   f'ON CONFLICT(name) DO UPDATE SET {sets}', [name] + list(values.values()))
+
+    def set_sync_state(self, name, **values):
+        with self._tx() as db: self._set_sync_state(db, name, values)
+
+    def mark_seen(self, name, keys=None):
+        """推送成功後，把送上試算表的主鍵記進 seen (keys 為 None 表示整張覆寫，改為目前所有本機主鍵)"""
+        with self._tx() as db:
+            db.execute("BEGIN IMMEDIATE")
+            row = db.execute('SELECT seen FROM "_sync_state" WHERE name = ?', (name,)).fetchone()
+            if keys is None:
+                seen = {_key(k) for (k,) in db.execute(f'SELECT "{TABLES[name][0]}" FROM "{name}"') if k is not None}
+            elif row is None or row[0] is None: return  # 還沒比對過，下次拉回時整份建立
+            else: seen = set(json.loads(row[0])) | {_key(k) for k in keys}
+            self._set_sync_state(db, name, {"seen": seen})
+
+    def keys(self, name):
+        """本機所有主鍵: {字串形式: 原始值} (與試算表上的文字比對用)"""
+        with self._tx() as db:
+            return {_key(k): k for (k,) in db.execute(f'SELECT "{TABLES[name][0]}" FROM "{name}"') if k is not None}
+
+    def _sync_sequence(self, db, name):
+        """外部寫入明確的 id 後 (整張覆寫、匯入)，把序號推進到目前最大 id"""
+        if TABLES[name][0] != "id": return
+        db.execute('INSERT INTO "_sequences" VALUES (?, 0) ON CONFLICT(name) DO NOTHING', (name,))
+        db.execute(f'UPDATE "_sequences" SET value = MAX(value, (SELECT COALESCE(MAX(id), 0) FROM "{name}")) WHERE name = ?', (name,))
+
+    def _version(self, db, name):
+        row = db.execute('SELECT version FROM "_versions" WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else 0
+
+    def version(self, name):
+        with self._tx() as db: return self._version(db, name)
+
+    def versions(self, names):
+        with self._tx() as db: return tuple(self._version(db, n) for n in names)
+
+    def count(self, name):
+        with self._tx() as db:
+            return db.execute(f'SELECT COUNT(*) FROM "{name}"').fetchone()[0]
+
+    def read(self, name):
+        return self.snapshot(name)[1]
+
+    def snapshot(self, name, owner=None):
+        """在同一個讀取交易內取得 (版本號, 資料)，兩者保證一致。
+        指定 owner 時只讀取該業務的資料 (在 SQLite 內篩選)，版本號為 _owner_tables 各表版本的 tuple"""
+        with self._tx() as db:
+            db.execute("BEGIN")
+            if owner is None: return self._version(db, name), pd.read_sql_query(f'SELECT * FROM "{name}"', db)
+            return (tuple(self._version(db, n) for n in _owner_tables(name)),
+                    pd.read_sql_query(f'SELECT * FROM "{name}" WHERE {_owner_filter(name)}', db, params=(owner,)))
+
+    def select(self, name, column, value):
+        """以欄位值查詢資料列 (有索引的欄位只讀取相符的列)"""
+        with self._tx() as db:
+            return pd.read_sql_query(f'SELECT * FROM "{name}" WHERE "{column}" = ?', db, params=(_value(value),))
+
+    def write(self, name, df):
+        """整張資料表覆寫"""
+        cols = [str(c) for c in df.columns if not str(c).startswith("Unnamed")]
+        with self._tx() as db:
+            self._columns(db, name, cols)
+            db.execute(f'DELETE FROM "{name}"')
+            if cols:
+                marks = ", ".join("?" * len(cols))
+                names = ", ".join(f'"{c}"' for c in cols)
+                db.executemany(f'INSERT OR REPLACE INTO "{name}" ({names}) VALUES ({marks})', _records(df, cols))
+            self._sync_sequence(db, name)
+            self._enqueue(db, name, "push", [])
+            return self._bump(db, name)
+
+    def _insert(self, db, name, df):
+        cols = [str(c) for c in df.columns]
+        self._columns(db, name, cols)
+        marks = ", ".join("?" * len(cols))
+        names = ", ".join(f'"{c}"' for c in cols)
+        records = _records(df, cols)
+        db.executemany(f'INSERT INTO "{name}" ({names}) VALUES ({marks})', records)
+        self._sync_sequence(db, name)
+        self._enqueue(db, name, "append", [[dict(zip(cols, r)) for r in records]])
+
+    def append(self, name, rows):
+        """新增資料列 (list of dict 或 DataFrame)"""
+        df = rows if isinstance(rows, pd.DataFrame) else pd.DataFrame(rows)
+        with self._tx() as db:
+            self._insert(db, name, df)
+            return self._bump(db, name)
+
+    def bulk_append(self, name, chunks):
+        """在同一個交易內逐批寫入並配發 id (記憶體只保留一批)；任何一批失敗就整個回滾。
+        回傳 (新版本號, 寫入筆數)"""
+        total = 0
+        with self._tx() as db:
+            db.execute("BEGIN IMMEDIATE")
+            for df in chunks:
+                if df.empty: continue
+                self._insert(db, name, df.assign(id=list(self._allocate(db, name, len(df)))))
+                total += len(df)
+            return self._bump(db, name), total
+
+    def iter_chunks(self, name, chunksize):
+        """分批讀出整張資料表 (匯出用)，不會一次載入全部"""
+        with self._tx() as db:
+            db.execute("BEGIN")
+            yield from pd.read_sql_query(f'SELECT * FROM "{name}"', db, chunksize=chunksize)
+
+    def _row_version(self, db, name, key):
+        row = db.execute(f'SELECT COALESCE("{ROW_VERSION}", 0) FROM "{name}" WHERE "{TABLES[name][0]}" = ?', (_value(key),)).fetchone()
+        return row[0] if row else None
+
+    def update(self, name, key, values, expected=None):
+        """依主鍵更新單一資料列的部分欄位；回傳 (新版本號, 實際寫入的欄位)。
+        資料表有 row_version 時版本 +1，並可帶 expected (讀取時的 row_version)：不相符就丟出 ConflictError、不寫入"""
+        pk = TABLES[name][0]
+        values = {c: _value(v) for c, v in values.items() if c != ROW_VERSION}
+        versioned = ROW_VERSION in TABLES[name][1]
+        sets = ", ".join([f'"{c}" = ?' for c in values] + ([f'"{ROW_VERSION}" = COALESCE("{ROW_VERSION}", 0) + 1'] if versioned else []))
+        where, params = f'"{pk}" = ?', list(values.values()) + [_value(key)]
+        if versioned and expected is not None:
+            where, params = where + f' AND COALESCE("{ROW_VERSION}", 0) = ?', params + [_value(expected)]
+        with self._tx() as db:
+            self._columns(db, name, list(values))
+            if db.execute(f'UPDATE "{name}" SET {sets} WHERE {where}', params).rowcount == 0 and expected is not None:
+                raise ConflictError(name, key, expected, self._row_version(db, name, key))
+            if versioned: values[ROW_VERSION] = self._row_version(db, name, key)
+            self._enqueue(db, name, "update", [_value(key), values])
+            return self._bump(db, name), values
+
+    def _delete(self, db, name, keys, expected=None):
+        pk = TABLES[name][0]
+        keys = [_value(k) for k in keys]
+        expected = expected if ROW_VERSION in TABLES[name][1] else None
+        for k in keys:
+            if expected is None or k not in expected:
+                db.execute(f'DELETE FROM "{name}" WHERE "{pk}" = ?', (k,))
+            elif db.execute(f'DELETE FROM "{name}" WHERE "{pk}" = ? AND COALESCE("{ROW_VERSION}", 0) = ?',
+                            (k, _value(expected[k]))).rowcount == 0:
+                raise ConflictError(name, k, expected[k], self._row_version(db, name, k))
+        self._enqueue(db, name, "delete", [keys])
+        return self._bump(db, name), keys
+
+    def _children(self, db, name, keys):
+        """REFERENCES 中參照這些主鍵的子表資料列: [(子表, [主鍵])]"""
+        out = []
+        for child, fk in REFERENCES.get(name, []):
+            ids = []
+            for i in range(0, len(keys), 500):  # SQLite 參數數量有上限，分批查詢
+                part = keys[i:i + 500]
+                ids += [r[0] for r in db.execute(f'SELECT "{TABLES[child][0]}" FROM "{child}" WHERE "{fk}" IN ({", ".join("?" * len(part))})', part)]
+            out.append((child, ids))
+        return out
+
+    def delete(self, name, keys, expected=None):
+        """依主鍵刪除資料列，並在同一交易內連帶刪除 REFERENCES 子表中參照它們的資料列。
+        expected 為 {主鍵: row_version}，任一列版本不符就整批不刪並丟出 ConflictError。
+        回傳 {資料表: (新版本號, 刪除的主鍵)}，主表在前"""
+        with self._tx() as db:
+            db.execute("BEGIN IMMEDIATE")
+            out = {name: self._delete(db, name, keys, expected)}
+            for child, ids in self._children(db, name, out[name][1]):
+                if ids: out[child] = self._delete(db, child, ids)
+            return out
+
+    def orphans(self):
+        """子表中外鍵指向不存在主表資料列的筆數: {子表: 筆數}"""
+        with self._tx() as db:
+            return {child: db.execute(self._orphan_sql(parent, child, fk, "COUNT(*)")).fetchone()[0]
+                    for parent, refs in REFERENCES.items() for child, fk in refs}
+
+    @staticmethod
+    def _orphan_sql(parent, child, fk, select):
+        return (f'SELECT {select} FROM "{child}" WHERE "{fk}" IS NOT NULL AND "{fk}" NOT IN '
+                f'(SELECT "{TABLES[parent][0]}" FROM "{parent}" WHERE "{TABLES[parent][0]}" IS NOT NULL)')
+
+    def compact_orphans(self):
+        """刪除所有孤兒資料列 (一個交易)，再 VACUUM 回收檔案空間。回傳 {子表: (新版本號, 刪除的主鍵)}"""
+        out = {}
+        with self._tx() as db:
+            db.execute("BEGIN IMMEDIATE")
+            for parent, refs in REFERENCES.items():
+                for child, fk in refs:
+                    ids = [r[0] for r in db.execute(self._orphan_sql(parent, child, fk, f'"{TABLES[child][0]}"'))]
+                    if ids: out[child] = self._delete(db, child, ids)
+        if out:
+            with self._tx() as db: db.execute("VACUUM")
+        return out
+
+    def _allocate(self, db, name, n):
+        if db.execute('SELECT 1 FROM "_sequences" WHERE name = ?', (name,)).fetchone() is None:
+            self._sync_sequence(db, name)
+        db.execute('UPDATE "_sequences" SET value = value + ? WHERE name = ?', (n, name))
+        last = db.execute('SELECT value FROM "_sequences" WHERE name = ?', (name,)).fetchone()[0]
+        return range(last - n + 1, last + 1)
+
+    def allocate_ids(self, name, n=1):
+        """配發 n 個連續且不重複的 id；BEGIN IMMEDIATE 讓同時配發的 session 依序取號，不需讀取整張表"""
+        with self._tx() as db:
+            db.execute("BEGIN IMMEDIATE")
+            return self._allocate(db, name, n)
+
+    def apply_remote(self, name, new, changed, gone, state):
+        """套用試算表上直接做的變更 (不寫入 _outbox，才不會再送回去)：new 為新資料列 (list of dict)，
+        changed 為 [(主鍵, {欄位: 值})]，gone 為已刪除的主鍵，state 為套用後的 _sync_state。
+        這期間本機有新的待送變更就放棄 (同步狀態也不前進)，下次再比對。
+        回傳 [(op, 新版本號, 參數...)] 供快取與索引依序套用"""
+        pk, out = TABLES[name][0], []
+        versioned = ROW_VERSION in TABLES[name][1]
+        with self._tx() as db:
+            db.execute("BEGIN IMMEDIATE")
+            if db.execute('SELECT 1 FROM "_outbox" WHERE name = ? LIMIT 1', (name,)).fetchone(): return []
+            if new:
+                cols = list(dict.fromkeys(c for r in new for c in r))
+                self._columns(db, name, cols)
+                names, marks = ", ".join(f'"{c}"' for c in cols), ", ".join("?" * len(cols))
+                db.executemany(f'INSERT OR REPLACE INTO "{name}" ({names}) VALUES ({marks})', [[r.get(c) for c in cols] for r in new])
+                self._sync_sequence(db, name)
+                out.append(("append", self._bump(db, name), [{c: r.get(c) for c in cols} for r in new]))
+            for key, values in changed:
+                self._columns(db, name, list(values))
+                sets = [f'"{c}" = ?' for c in values] + ([f'"{ROW_VERSION}" = COALESCE("{ROW_VERSION}", 0) + 1'] if versioned else [])
+                db.execute(f'UPDATE "{name}" SET {", ".join(sets)} WHERE "{pk}" = ?', list(values.values()) + [key])
+                if versioned: values = {**values, ROW_VERSION: self._row_version(db, name, key)}
+                out.append(("update", self._bump(db, name), key, values))
+            if gone:
+                db.executemany(f'DELETE FROM "{name}" WHERE "{pk}" = ?', [(k,) for k in gone])
+                out.append(("delete", self._bump(db, name), list(gone)))
+            self._set_sync_state(db, name, state)
+            # 修改太多時只留最後的版本號，讓索引整個重建，不逐筆套用
+            if len(changed) > SYNC_PULL_MAX_UPDATES: out = [("import", out[-1][1])]
+        return out
+
+class SheetsMirror:
+    """Google Sheets 鏡像：啟動時匯入資料，之後由 SheetsSyncWorker 批次送出變更"""
+    def __init__(self, conn):
+        self.conn = conn
+
+    def read(self, name):
+        return self.conn.read(worksheet=name, ttl=0)
+
+    def push(self, name, df):
+        """整張分頁覆寫"""
+        self.conn.update(worksheet=name, data=df)
+
+    def _worksheet(self, name):
+        ws = self.conn.client._select_worksheet(worksheet=name)
+        header = ws.row_values(1)
+        if not header:
+            header = list(TABLES[name][1])
+            ws.append_row(header)
+        return ws, header
+
+    def columns(self, name, cols):
+        """只讀取指定的欄 (一次請求，不含標頭)；回傳 (標頭, 每列的值 tuple)，試算表沒有的欄不會出現在 tuple 中"""
+        from gspread.utils import rowcol_to_a1
+        ws, header = self._worksheet(name)
+        letters = [rowcol_to_a1(1, header.index(c) + 1).rstrip("0123456789") for c in cols if c in header]
+        values = ws.batch_get([f"{l}2:{l}" for l in letters]) if letters else []
+        n = max((len(v) for v in values), default=0)
+        padded = [[r[0] if r else "" for r in v] + [""] * (n - len(v)) for v in values]
+        return header, list(zip(*padded))
+
+    def rows(self, name, header, numbers):
+        """下載指定列號的資料；連續的列合併成一個範圍，全部在一次請求內"""
+        from gspread.utils import rowcol_to_a1
+        runs = []
+        for r in sorted(numbers):
+            if runs and r == runs[-1][1] + 1: runs[-1][1] = r
+            else: runs.append([r, r])
+        if not runs: return pd.DataFrame(columns=header)
+        ws = self.conn.client._select_worksheet(worksheet=name)
+        last = rowcol_to_a1(1, len(header)).rstrip("0123456789")
+        values = ws.batch_get([f"A{a}:{last}{b}" for a, b in runs])
+        return pd.DataFrame([list(r) + [""] * (len(header) - len(r)) for v in values for r in v], columns=header)
+
+    def _row_numbers(self, ws, header, name):
+        """主鍵 → 試算表列號 (只讀取主鍵那一欄)"""
+        keys = ws.col_values(header.index(TABLES[name][0]) + 1)
+        return {k: i + 1 for i, k in enumerate(keys) if i > 0}
+
+    def append(self, name, rows):
+        """逐列附加，只送出新資料列"""
+        ws, header = self._worksheet(name)
+        ws.append_rows([["" if r.get(c) is None else r.get(c) for c in header] for r in rows],
+                       value_input_option="USER_ENTERED")
+
+    def update(self, name, changes):
+        """changes: {主鍵: {欄位: 新值}}，所有變動的儲存格合成一次請求"""
+        from gspread.utils import rowcol_to_a1
+        ws, header = self._worksheet(name)
+        rows = self._row_numbers(ws, header, name)
+        data = [{"range": rowcol_to_a1(rows[str(key)], header.index(c) + 1), "values": [["" if v is None else v]]}
+                for key, values in changes.items() if str(key) in rows for c, v in values.items() if c in header]
+        if data: ws.batch_update(data, value_input_option="USER_ENTERED")
+
+    def delete(self, name, keys):
+        """所有要刪除的列合成一次請求 (由下往上刪，列號才不會位移)"""
+        ws, header = self._worksheet(name)
+        rows = self._row_numbers(ws, header, name)
+        targets = sorted({rows[str(k)] for k in keys if str(k) in rows}, reverse=True)
+        if not targets: return
+        ws.spreadsheet.batch_update({"requests": [
+            {"deleteDimension": {"range": {"sheetId": ws.id, "dimension": "ROWS", "startIndex": r - 1, "endIndex": r}}}
+            for r in targets]})
+
+def _cell(v):
+    """比對用的儲存格值：空字串與缺值一律視為 None"""
+    v = _value(v)
+    return None if v == "" else v
+
+def _key(v):
+    """主鍵的文字形式：試算表讀回的 11.0、"11 " 與本機的 11 視為同一個鍵"""
+    v = _value(v)
+    if isinstance(v, float) and v.is_integer(): v = int(v)
+    return "" if v is None else str(v).strip()
+
+def _keyed(df, pk):
+    """主鍵 (字串) → 該列 {欄位: 原始值}；不轉型，寫入本機的是試算表上的原值 (與啟動時整張匯入相同)"""
+    return {_key(r[pk]): r for r in ({c: _cell(v) for c, v in row.items()} for row in df.to_dict("records")) if r.get(pk) is not None}
+
+def _same(a, b):
+    """比對儲存格：本機 REAL / TEXT 欄存回的值與試算表上的值型別可能不同 (1500 與 1500.0、"11" 與 11)"""
+    if a == b or str(a) == str(b): return True
+    try: return float(a) == float(b)
+    except (TypeError, ValueError): return False
+
+def _differs(remote, local):
+    return any(not _same(remote[c], local.get(c)) for c in remote if c != ROW_VERSION)
+
+def _coalesce(ops):
+    """合併同一分頁的連續變更：含整張覆寫時只送一次覆寫 (讀取當下最新資料)，
+    否則連續的新增 / 更新 / 刪除各合併成一次請求。ops 為 [(seq, op, payload)]，
+    回傳 [(op, 合併後的 payload, 涵蓋的 seq)]，每個請求成功後就確認它涵蓋的 seq"""
+    if any(op == "push" for _, op, _ in ops): return [("push", None, [seq for seq, _, _ in ops])]
+    out = []
+    for seq, op, payload in ops:
+        if op == "update": payload = {payload[0]: payload[1]}
+        else: payload = list(payload[0])
+        # 單次新增請求不超過 SYNC_BATCH_ROWS 列 (大量匯入時分成多次)
+        if out and out[-1][0] == op and not (op == "append" and len(out[-1][1]) >= SYNC_BATCH_ROWS):
+            if op == "update":
+                for key, values in payload.items(): out[-1][1].setdefault(key, {}).update(values)
+            else: out[-1][1].extend(payload)
+            out[-1][2].append(seq)
+        else: out.append((op, payload, [seq]))
+    return out
+
+class SheetsSyncWorker(threading.Thread):
+    """背景同步：從 _outbox 取出待送的變更，每個分頁合併成批次送出，失敗時指數退避重試"""
+    def __init__(self, store, mirror, metrics, on_change):
+        super().__init__(daemon=True, name="sheets-sync")
+        self.store, self.mirror, self.metrics = store, mirror, metrics
+        self.on_change = on_change  # 拉回的變更寫入本機後呼叫 (op, 分頁, 版本號, 參數...)，更新快取與索引
+        self.wake = threading.Event()
+        self.errors = {}
+        self.pulled_at = 0.0
+
+    def run(self):
+        while True:
+            self.wake.wait(timeout=SYNC_POLL_SECONDS)
+            self.wake.clear()
+            try:
+                self.flush()
+                self.errors.pop("(同步佇列)", None)
+            except Exception as e:
+                self.errors["(同步佇列)"] = str(e)
+            if time.time() - self.pulled_at >= SYNC_PULL_SECONDS:
+                self.pulled_at = time.time()
+                self.pull()
+
+    def pull(self, names=TABLES):
+        """拉回直接在試算表上做的新增 / 修改 / 刪除；本機還有未送出變更的分頁先跳過，等推送完再比對"""
+        for name in names:
+            if self.store.outbox_size(name): continue
+            try:
+                with self.metrics.timer("背景同步", f"sheets.pull:{name}") as m:
+                    changes = self._pull(name, time.time(), m)
+                for op, version, *args in changes: self.on_change(op, name, version, *args)
+                self.errors.pop(f"{name} (拉回)", None)
+            except Exception as e:
+                self.errors[f"{name} (拉回)"] = str(e)
+
+    def _pull(self, name, now, m):
+        pk = TABLES[name][0]
+        state, local = self.store.sync_state(name), self.store.keys(name)
+        before = state["seen"] or set()  # 上次在試算表上看到的主鍵
+        if now - state["reconciled_at"] >= SYNC_RECONCILE_SECONDS:
+            # 定期整張比對：找出沒有 updated_at 欄時察覺不到的修改
+            remote = self.mirror.read(name)
+            m["bytes"] = _nbytes(remote)
+            if pk not in remote.columns: return []
+            rows = _keyed(remote, pk)
+            current = _keyed(self.store.read(name), pk)
+            stamps = [str(r.get(SYNC_UPDATED_AT) or "") for r in rows.values()]
+            state = dict(rows=len(rows), updated_at=max(stamps, default=""), pulled_at=now, reconciled_at=now, seen=set(rows))
+        else:
+            # 平常只讀主鍵欄 (與 updated_at 欄)，只下載新出現或時間戳記較新的列
+            header, values = self.mirror.columns(name, [pk, SYNC_UPDATED_AT])
+            if pk not in header: return []
+            stamped = SYNC_UPDATED_AT in header
+            seen, fetch, since = set(), [], state["updated_at"]
+            for i, v in enumerate(values):
+                key = _key(v[0])
+                if not key: continue
+                seen.add(key)
+                if key not in local or (stamped and str(v[1]) > since): fetch.append(i + 2)
+            stamp = max([since] + [str(v[1]) for v in values]) if stamped else since
+            delta = self.mirror.rows(name, header, fetch)
+            m["bytes"] = _nbytes(delta)
+            rows = _keyed(delta, pk)
+            current = None
+            rows.update({k: None for k in seen if k not in rows})  # 只知道還在、沒有下載的列
+            state = dict(rows=len(seen), updated_at=stamp, pulled_at=now, seen=seen)
+        new = [r for k, r in rows.items() if r is not None and k not in local]
+        changed = [(local[k], {c: v for c, v in r.items() if c not in (pk, ROW_VERSION)}) for k, r in rows.items()
+                   if r is not None and k in local and (current is None or _differs(r, current.get(k, {})))]
+        # 只刪除上次在試算表上看過、這次不見的列；從沒送上去的本機資料 (例如離線時新增) 不算遠端刪除
+        gone = [v for k, v in local.items() if k not in rows and k in before]
+        # 同步狀態 (時間戳記高水位) 與變更在同一交易內前進；apply_remote 放棄時下次會重新下載這些列
+        if new or changed or gone: return self.store.apply_remote(name, new, changed, gone, state)
+        self.store.set_sync_state(name, **state)
+        return []
+
+    def flush(self):
+        groups = defaultdict(list)
+        for entry in self.store.pending(): groups[entry[1]].append(entry)
+        now = time.time()
+        for name, entries in groups.items():
+            # 同一分頁最早的變更還在等待重試時，後面的也要等，才不會亂序
+            if entries[0][5] > now: continue
+            attempts = {e[0]: e[4] for e in entries}
+            try:
+                for op, payload, seqs in _coalesce([(e[0], e[2], e[3]) for e in entries]):
+                    with self.metrics.timer("背景同步", f"sheets.{op}:{name}") as m:
+                        if op == "push":
+                            df = self.store.read(name)
+                            m["bytes"] = _nbytes(df)
+                            self.mirror.push(name, df)
+                            self.store.mark_seen(name)
+                        else:
+                            m["bytes"] = len(json.dumps(payload, ensure_ascii=False).encode())
+                            getattr(self.mirror, op)(name, payload)
+                            if op == "append": self.store.mark_seen(name, [r.get(TABLES[name][0]) for r in payload])
+                    # 送出一個請求就確認一次：後面的請求失敗時，已送出的新增不會重送而重複
+                    self.store.ack(seqs)
+                    for q in seqs: attempts.pop(q)
+                self.errors.pop(name, None)
+            except Exception as e:
+                n = next(iter(attempts.values())) + 1
+                self.store.retry_later(list(attempts), n, now + min(2 ** n, SYNC_MAX_BACKOFF))
+                self.errors[name] = f"{e} (第 {n} 次重試)"
+
+# --- 效能量測 ---
+def _quantile(values, q):
+    """已排序數列的分位數 (取最接近的排名)"""
+    return values[round(q * (len(values) - 1))] if values else 0.0
+
+def _nbytes(df):
+    """DataFrame 佔用的位元組 (不深入計算字串內容，成本很低)"""
+    return int(df.memory_usage(index=False).sum()) if isinstance(df, pd.DataFrame) else 0
+
+def _label(v):
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+class Metrics:
+    """跨 session 共用的熱路徑量測：依 (頁面, 區段) 彙總耗時分位數、呼叫次數與傳輸的位元組"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.samples = defaultdict(lambda: deque(maxlen=METRIC_SAMPLES))
+            self.counts, self.seconds, self.bytes = defaultdict(int), defaultdict(float), defaultdict(int)
+            self.since = time.time()
+
+    @contextmanager
+    def timer(self, page, section):
+        """量測一段程式；可在 with 內設定 m["bytes"] 記錄傳輸量"""
+        m = {"bytes": 0}
+        t = time.perf_counter()
+        try: yield m
+        finally: self.record(page, section, time.perf_counter() - t, m["bytes"])
+
+    def record(self, page, section, seconds, nbytes=0):
+        key = (page, section)
+        with self.lock:
+            self.samples[key].append(seconds)
+            self.counts[key] += 1
+            self.seconds[key] += seconds
+            self.bytes[key] += nbytes
+
+    def summary(self):
+        """每個 (頁面, 區段) 一列：呼叫次數、p50 / p95 (毫秒)、累計秒數與位元組"""
+        with self.lock:
+            snap = [(key, sorted(v), self.counts[key], self.seconds[key], self.bytes[key]) for key, v in self.samples.items()]
+        return [{"page": page, "section": section, "count": count,
+                 "p50_ms": round(_quantile(s, 0.5) * 1000, 3), "p95_ms": round(_quantile(s, 0.95) * 1000, 3),
+                 "total_s": round(total, 4), "bytes": nbytes}
+                for (page, section), s, count, total, nbytes in sorted(snap)]
+
+    def to_json(self, extra=None):
+        return json.dumps({"since": datetime.datetime.fromtimestamp(self.since).isoformat(timespec="seconds"),
+                           "sections": self.summary(), **(extra or {})}, ensure_ascii=False, indent=2)
+
+    def to_prometheus(self, gauges=None):
+        """Prometheus 文字格式；gauges 為額外的 {指標名稱: 數值}"""
+        lines = ["# HELP crm_section_seconds 各頁面區段的耗時", "# TYPE crm_section_seconds summary"]
+        rows = self.summary()
+        for r in rows:
+            labels = f'page="{_label(r["page"])}",section="{_label(r["section"])}"'
+            lines += [f'crm_section_seconds{{{labels},quantile="0.5"}} {r["p50_ms"] / 1000}',
+                      f'crm_section_seconds{{{labels},quantile="0.95"}} {r["p95_ms"] / 1000}',
+                      f'crm_section_seconds_sum{{{labels}}} {r["total_s"]}',
+                      f'crm_section_seconds_count{{{labels}}} {r["count"]}']
+        lines += ["# HELP crm_section_bytes_total 各頁面區段讀寫的資料量", "# TYPE crm_section_bytes_total counter"]
+        lines += [f'crm_section_bytes_total{{page="{_label(r["page"])}",section="{_label(r["section"])}"}} {r["bytes"]}' for r in rows]
+        for name, value in (gauges or {}).items():
+            lines += [f"# TYPE {name} gauge", f"{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+@st.cache_resource
+def get_metrics():
+    return Metrics()
+
+def _current_page():
+    ss = st.session_state
+    if not ss.get('logged_in'): return "登入"
+    if ss.get('selected_client_id'): return "客戶詳細資料"
+    return ss.get('current_view') or "儀表板"
+
+@contextmanager
+def timed(section):
+    """量測目前頁面的一段程式，可當 with 區塊或裝飾器使用"""
+    with get_metrics().timer(_current_page(), section) as m: yield m
+
+@st.cache_resource
+def get_sheets_conn():
+    """建立 Google Sheets 連線；未設定 secrets 時回傳 None (純本機模式)"""
+    try:
+        # 1. 讀取 secrets
+        raw_secrets = st.secrets["connections"]["gsheets"]
+    except (KeyError, FileNotFoundError):
+        return None
+
+    # 2. 修正 private_key 的換行問題，並放入新的字典
+    secrets_dict = {
+        **raw_secrets,
+        "private_key": raw_secrets["private_key"].replace("\\n", "\n")
+    }
+
+    # 3. 【關鍵修正】刪除會導致衝突的 "type" 欄位
+    if "type" in secrets_dict:
+        del secrets_dict["type"]
+
+    # 4. 建立連線 (gsheets 套件載入很慢，只在有設定時才匯入)
+    from streamlit_gsheets import GSheetsConnection
+    return st.connection("gsheets", type=GSheetsConnection, **secrets_dict)
+
+@st.cache_resource
+def get_mirror():
+    conn = get_sheets_conn()
+    return SheetsMirror(conn) if conn is not None else None
+
+@st.cache_resource
+def get_store():
+    """整個程序共用一個本機資料庫；本機資料表為空時先從雲端匯入"""
+    store = LocalStore(DB_PATH)
+    mirror = get_mirror()
+    if mirror is not None:
+        for name in TABLES:
+            if store.count(name) > 0: continue
+            try:
+                with timed(f"sheets.read:{name}") as m:
+                    df = mirror.read(name)
+                    m["bytes"] = _nbytes(df)
+                store.write(name, df)
+                # 剛整張匯入，背景拉回從這裡開始只比對增量
+                seen = {_key(k) for k in df[TABLES[name][0]]} - {""} if TABLES[name][0] in df.columns else set()
+                store.set_sync_state(name, rows=len(df), pulled_at=time.time(), reconciled_at=time.time(), seen=seen)
+            except Exception as e: st.error(f"從雲端匯入 {name} 失敗: {e}")
+        # 匯入完成後才開始記錄要回寫雲端的變更
+        store.outbox = True
+    return store
+
+@st.cache_resource
+def get_sync_worker():
+    """啟動背景同步執行緒 (每個程序一次)；未設定雲端鏡像時回傳 None"""
+    mirror = get_mirror()
+    if mirror is None: return None
+    worker = SheetsSyncWorker(get_store(), mirror, get_metrics(), _after_write)
+    worker.start()
+    return worker
+
+def _table_version(store, name, owner=None):
+    """分頁 (或某業務的分區) 目前的版本號，與 LocalStore.snapshot 回傳的版本號可直接比較"""
+    if owner is None or not _owner_filter(name): return store.version(name)
+    return store.versions(_owner_tables(name))
+
+class TableCache:
+    """跨 session 共用的分頁快取，以資料表版本號判斷是否需要重新讀取"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tables = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, store, name, owner=None):
+        return self.get_versioned(store, name, owner)[1]
+
+    def get_versioned(self, store, name, owner=None):
+        """回傳 (版本號, 資料)；版本未變時直接使用快取。
+        owner 只讀取該業務的資料，以 (分頁, 業務) 分開快取；不分業務的分頁一律讀整張"""
+        owner = owner if _owner_filter(name) else None
+        key, version = (name, owner), _table_version(store, name, owner)
+        with self.lock:
+            cached = self.tables.get(key)
+            if cached and cached[0] == version:
+                self.hits += 1
+                return cached
+            self.misses += 1
+        with timed(f"sqlite.load:{name}") as m:
+            version, df = store.snapshot(name, owner)
+            cached = (version, coerce(name, df))
+            m["bytes"] = _nbytes(cached[1])
+        with self.lock: self.tables[key] = cached
+        return cached
+
+    def invalidate(self, name):
+        """丟掉受這張表寫入影響的快取 (含各業務的分區)"""
+        with self.lock:
+            for key in [k for k in self.tables if k[0] == name or (k[1] is not None and name in _owner_tables(k[0]))]:
+                del self.tables[key]
+
+    def stats(self):
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses,
+                    "tables": {(n if o is None else f"{n}:{o}"): v for (n, o), (v, _) in self.tables.items()}}
+
+@st.cache_resource
+def get_cache():
+    return TableCache()
+
+def cache_stats():
+    """讀取快取的命中 / 未命中次數"""
+    return get_cache().stats()
+
+class DerivedIndex:
+    """由資料表衍生的記憶體索引；子類別實作 build，能增量更新的變更在 apply 回傳 True"""
+    tables = ()
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.versions = {}
+
+    def build(self, *frames): raise NotImplementedError
+
+    def apply(self, name, op, *args): return False
+
+class IndexRegistry:
+    """跨 session 共用的衍生索引；寫入時增量更新，無法增量時於下次讀取整個重建"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.indexes = {}
+
+    def get(self, cls, store, cache, owner=None):
+        """owner 為業務帳號時，另建一份只含該業務資料的索引 (操作員的頁面不必載入全公司的資料)"""
+        # 以類別名稱當鍵：Streamlit 每次 rerun 都會重新執行腳本，類別物件每輪都不同
+        key = (cls.__name__, owner)
+        versions = {t: _table_version(store, t, owner) for t in cls.tables}
+        with self.lock:
+            index = self.indexes.get(key)
+            if index is not None and index.versions == versions: return index
+        index = cls()
+        snaps = [cache.get_versioned(store, t, owner) for t in cls.tables]
+        with timed(f"index.build:{cls.__name__}"): index.build(*[df for _, df in snaps])
+        index.versions = {t: v for t, (v, _) in zip(cls.tables, snaps)}
+        with self.lock: self.indexes[key] = index
+        return index
+
+    def notify(self, name, version, op, *args):
+        """寫入後呼叫：索引停在前一版時套用增量，否則保持過期等待重建。
+        業務分區的索引無法判斷變更屬於哪位業務，一律等下次讀取時從分區重建 (資料量小)"""
+        with self.lock: indexes = [index for (_, owner), index in self.indexes.items() if owner is None]
+        for index in indexes:
+            if name not in index.tables: continue
+            with index.lock:
+                if index.versions.get(name) == version - 1 and index.apply(name, op, *args):
+                    index.versions[name] = version
+
+@st.cache_resource
+def get_indexes():
+    return IndexRegistry()
+
+def get_index(cls, owner=None):
+    return get_indexes().get(cls, get_store(), get_cache(), owner)
+
+def _norm(v):
+    return "" if v is None or (not isinstance(v, str) and pd.isna(v)) else str(v).strip().lower()
+
+def _digits(v): return re.sub(r"\D", "", _norm(v))
+
+def _grams(text): return {text[i:i + 2] for i in range(len(text) - 1)}
+
+class ClientSearchIndex(DerivedIndex):
+    """客戶搜尋索引：每個欄位各自以 bigram 建立倒排索引 (名稱另有單字索引)，電話只保留數字"""
+    tables = ("clients",)
+    # 欄位權重：名稱 > 電話 > 統編 > Email > 專案
+    WEIGHTS = {"name": 50, "phone": 40, "invoice_number": 30, "email": 20, "project": 10}
+
+    def build(self, df):
+        self.docs = {}
+        self.grams, self.chars = defaultdict(set), defaultdict(set)
+        self.phones, self.tax_ids = defaultdict(set), defaultdict(set)
+        for row in df.reindex(columns=["id", *self.WEIGHTS]).to_dict("records"): self._add(row)
+
+    def _add(self, row):
+        cid = _value(row.get("id"))
+        if cid is None: return
+        doc = {f: _norm(row.get(f)) for f in self.WEIGHTS}
+        doc["phone"] = _digits(row.get("phone"))
+        self.docs[cid] = doc
+        grams = self.grams
+        for f, text in doc.items():
+            for i in range(len(text) - 1): grams[f, text[i:i + 2]].add(cid)
+        for ch in set(doc["name"]): self.chars[ch].add(cid)
+        if doc["phone"]: self.phones[doc["phone"]].add(cid)
+        if doc["invoice_number"]: self.tax_ids[doc["invoice_number"]].add(cid)
+
+    def _remove(self, cid):
+        doc = self.docs.pop(cid, None)
+        if doc is None: return
+        for f, text in doc.items():
+            for g in _grams(text): self.grams[f, g].discard(cid)
+        for ch in set(doc["name"]): self.chars[ch].discard(cid)
+        self.phones[doc["phone"]].discard(cid)
+        self.tax_ids[doc["invoice_number"]].discard(cid)
+
+    def apply(self, name, op, *args):
+        if op == "append":
+            for row in args[0]: self._add(row)
+        elif op == "update":
+            key, values = args
+            if key not in self.docs: return False
+            # 正規化後的值再正規化結果不變，可直接與新值合併重建
+            row = {"id": key, **self.docs[key], **values}
+            self._remove(key); self._add(row)
+        elif op == "delete":
+            for key in args[0]: self._remove(key)
+        else: return False
+        return True
+
+    def _candidates(self, f, needle):
+        if len(needle) == 1: return self.chars.get(needle, set())
+        sets = sorted((self.grams.get((f, g), set()) for g in _grams(needle)), key=len)
+        return sets[0].intersection(*sets[1:])
+
+    def search(self, q, limit=None):
+        """子字串搜尋，回傳依相關度排序的客戶 id (欄位權重 + 完全相符 > 開頭相符 > 包含)"""
+        q = _norm(q)
+        if not q: return []
+        digits = re.sub(r"\D", "", q) if re.fullmatch(r"[\d\s\-+()]+", q) else ""
+        scores = {}
+        with self.lock:
+            for f, w in self.WEIGHTS.items():
+                needle = digits if f == "phone" else q
+                # 單一字元只比對名稱
+                if len(needle) < (1 if f == "name" else 2): continue
+                for cid in self._candidates(f, needle):
+                    text = self.docs[cid][f]
+                    if needle not in text: continue
+                    score = w + (30 if text == needle else 10 if text.startswith(needle) else 0)
+                    if score > scores.get(cid, 0): scores[cid] = score
+        return sorted(scores, key=lambda c: (-scores[c], c))[:limit]
+
+    def find_phone(self, phone):
+        """以正規化電話 (只保留數字) 查客戶 id"""
+        with self.lock: return set(self.phones.get(_digits(phone), ()))
+
+    def find_tax_id(self, tax_id):
+        with self.lock: return set(self.tax_ids.get(_norm(tax_id), ()))
+
+def _day(v):
+    """日期欄位轉成 'YYYY-MM-DD' 字串，無法辨識時回傳空字串"""
+    if v is None or (not isinstance(v, str) and pd.isna(v)): return ""
+    if isinstance(v, str):
+        v = v.strip()
+        if re.match(r"\d{4}-\d{2}-\d{2}", v) or not v: return v[:10]
+        v = pd.to_datetime(v, errors="coerce", format="mixed")
+        if pd.isna(v): return ""
+    return pd.Timestamp(v).strftime("%Y-%m-%d")
+
+def _days(series):
+    """整欄日期轉成 'YYYY-MM-DD' 字串 (datetime64 欄位以向量化處理)"""
+    if pd.api.types.is_datetime64_any_dtype(series): return series.dt.strftime("%Y-%m-%d").fillna("")
+    return series.map(_day)
+
+def _amount(v):
+    try: v = float(re.sub(r"[,\s$]", "", v) if isinstance(v, str) else v)
+    except (TypeError, ValueError): return 0.0
+    return 0.0 if pd.isna(v) else v
+
+class SalesRollup(DerivedIndex):
+    """業績彙總：每位業務的月 / 年合計與每日金額 (前綴和)，新增或刪除銷售時增量更新"""
+    tables = ("sales",)
+
+    def build(self, df):
+        self.rows = {}
+        self.months, self.years = defaultdict(float), defaultdict(float)
+        self.days = defaultdict(lambda: defaultdict(float))
+        self.prefix = {}
+        cols = df.reindex(columns=["id", "created_by", "transaction_date", "sale_amount"])
+        cols["transaction_date"] = _days(cols["transaction_date"])
+        for sid, owner, day, amount in cols.itertuples(index=False, name=None):
+            self._add(_value(sid), owner, day, amount)
+
+    def _add(self, sid, owner, day, amount, sign=1):
+        owner = "" if owner is None or (not isinstance(owner, str) and pd.isna(owner)) else str(owner)
+        day, amount = _day(day), _amount(amount)
+        if sign > 0 and sid is not None: self.rows[sid] = (owner, day, amount)
+        if day:
+            self.months[owner, day[:7]] += sign * amount
+            self.years[owner, day[:4]] += sign * amount
+        self.days[owner][day] += sign * amount
+        self.prefix.pop(owner, None)
+
+    def apply(self, name, op, *args):
+        if op == "append":
+            for r in args[0]: self._add(_value(r.get("id")), r.get("created_by"), r.get("transaction_date"), r.get("sale_amount"))
+        elif op == "delete":
+            for key in args[0]:
+                if key in self.rows: self._add(key, *self.rows.pop(key), sign=-1)
+        elif op == "update":
+            key, values = args
+            if key not in self.rows: return False
+            owner, day, amount = self.rows.pop(key)
+            self._add(key, owner, day, amount, sign=-1)
+            self._add(key, values.get("created_by", owner), values.get("transaction_date", day), values.get("sale_amount", amount))
+        else: return False
+        return True
+
+    def owners(self):
+        with self.lock: return [o for o, days in self.days.items() if days]
+
+    def rank(self, period):
+        """某個月 ('YYYY-MM') 或某一年 ('YYYY') 各業務的合計"""
+        src = self.months if len(period) == 7 else self.years
+        with self.lock: return {o: round(v, 2) for (o, p), v in src.items() if p == period and round(v, 2)}
+
+    def _prefix_sums(self, owner):
+        if owner not in self.prefix:
+            days = sorted(self.days[owner])
+            self.prefix[owner] = (days, [0.0, *accumulate(self.days[owner][d] for d in days)])
+        return self.prefix[owner]
+
+    def range_total(self, start=None, end=None, owners=None):
+        """日期區間 [start, end] 的合計 ('YYYY-MM-DD'，省略代表不設限)，以前綴和計算不需掃描銷售紀錄"""
+        total = 0.0
+        with self.lock:
+            for owner in list(self.days) if owners is None else owners:
+                if owner not in self.days: continue
+                days, sums = self._prefix_sums(owner)
+                lo = bisect_left(days, start) if start else 0
+                hi = bisect_right(days, end) if end else len(days)
+                total += sums[hi] - sums[lo]
+        return round(total, 2)
+
+class ClientLedger(DerivedIndex):
+    """每位客戶的累積消費：客戶 id → [總額, 筆數, 最後購買日]，以及客戶 id → 銷售 id 的索引"""
+    tables = ("sales",)
+
+    def build(self, df):
+        self.totals = {}
+        self.by_client = defaultdict(set)
+        self.rows = {}
+        cols = df.reindex(columns=["id", "client_id", "transaction_date", "sale_amount"])
+        cols["transaction_date"] = _days(cols["transaction_date"])
+        for sid, cid, day, amount in cols.itertuples(index=False, name=None):
+            self._add(_value(sid), _value(cid), day, amount)
+
+    def _add(self, sid, cid, day, amount):
+        if sid is None or cid is None: return
+        day, amount = _day(day), _amount(amount)
+        self.rows[sid] = (cid, day, amount)
+        self.by_client[cid].add(sid)
+        total = self.totals.setdefault(cid, [0.0, 0, ""])
+        total[0] += amount; total[1] += 1; total[2] = max(total[2], day)
+
+    def _remove(self, sid):
+        if sid not in self.rows: return
+        cid, day, amount = self.rows.pop(sid)
+        self.by_client[cid].discard(sid)
+        total = self.totals[cid]
+        total[0] -= amount; total[1] -= 1
+        if total[1] == 0: del self.totals[cid]
+        elif day == total[2]: total[2] = max(self.rows[s][1] for s in self.by_client[cid])
+
+    def apply(self, name, op, *args):
+        if op == "append":
+            for r in args[0]: self._add(_value(r.get("id")), _value(r.get("client_id")), r.get("transaction_date"), r.get("sale_amount"))
+        elif op == "delete":
+            for key in args[0]: self._remove(key)
+        elif op == "update":
+            key, values = args
+            if key not in self.rows: return False
+            cid, day, amount = self.rows[key]
+            self._remove(key)
+            self._add(key, _value(values.get("client_id", cid)), values.get("transaction_date", day), values.get("sale_amount", amount))
+        else: return False
+        return True
+
+    def get(self, client_id):
+        """回傳 (總額, 筆數, 最後購買日)"""
+        with self.lock:
+            total, count, last = self.totals.get(_value(client_id), (0.0, 0, ""))
+            return round(total, 2), count, last
+
+    def spent(self):
+        """客戶 id → 累積消費，供客戶列表顯示與排序"""
+        with self.lock: return {cid: round(t[0], 2) for cid, t in self.totals.items()}
+
+class ReminderIndex(DerivedIndex):
+    """提醒索引：依提醒日排序的跟進紀錄，查詢時再帶入客戶名稱與負責業務"""
+    tables = ("interactions", "clients")
+
+    def build(self, df_inter, df_clients):
+        self.by_day = defaultdict(dict)
+        self.days = []
+        self.rows = {}
+        self.clients = {}
+        for cid, name, owner in df_clients.reindex(columns=["id", "name", "created_by"]).itertuples(index=False, name=None):
+            self._set_client(_value(cid), name, owner)
+        cols = df_inter.reindex(columns=["id", "client_id", "follow_up_date", "reminder_note", "content"])
+        cols["follow_up_date"] = _days(cols["follow_up_date"])
+        for row in cols.to_dict("records"): self._add(row)
+
+    def _set_client(self, cid, name, owner):
+        if cid is not None: self.clients[cid] = (_value(name), _value(owner))
+
+    def _add(self, row):
+        iid, day = _value(row.get("id")), _day(row.get("follow_up_date"))
+        if iid is None or not day: return
+        self.rows[iid] = day
+        if day not in self.by_day: insort(self.days, day)
+        self.by_day[day][iid] = {"id": iid, "client_id": _value(row.get("client_id")), "follow_up_date": day,
+                                 "reminder_note": _value(row.get("reminder_note")), "content": _value(row.get("content"))}
+
+    def _remove(self, iid):
+        day = self.rows.pop(iid, None)
+        if day is None: return
+        self.by_day[day].pop(iid, None)
+        if not self.by_day[day]:
+            del self.by_day[day]
+            self.days.pop(bisect_left(self.days, day))
+
+    def apply(self, name, op, *args):
+        if name == "clients":
+            if op == "append":
+                for r in args[0]: self._set_client(_value(r.get("id")), r.get("name"), r.get("created_by"))
+            elif op == "update":
+                key, values = args
+                if key not in self.clients: return False
+                name_, owner = self.clients[key]
+                self._set_client(key, values.get("name", name_), values.get("created_by", owner))
+            elif op == "delete":
+                for key in args[0]: self.clients.pop(key, None)
+            else: return False
+            return True
+        if op == "append":
+            for r in args[0]: self._add(r)
+        elif op == "delete":
+            for key in args[0]: self._remove(key)
+        elif op == "update":
+            key, values = args
+            if key not in self.rows: return False
+            row = {**self.by_day[self.rows[key]][key], **values}
+            self._remove(key); self._add(row)
+        else: return False
+        return True
+
+    def between(self, start=None, end=None, owner=None):
+        """提醒日在 [start, end] 內的提醒 ('YYYY-MM-DD'，省略代表不設限)，依日期排序並帶入客戶資料"""
+        out = []
+        with self.lock:
+            lo = bisect_left(self.days, start) if start else 0
+            hi = bisect_right(self.days, end) if end else len(self.days)
+            for day in self.days[lo:hi]:
+                for entry in self.by_day[day].values():
+                    name, created_by = self.clients.get(entry["client_id"], (None, None))
+                    if owner is not None and created_by != owner: continue
+                    out.append({**entry, "name": name, "created_by": created_by})
+        return out
+
+    def on(self, day, owner=None):
+        return self.between(day, day, owner)
+
+    def counts(self, start, end, owner=None):
+        """每日提醒件數，供月曆使用"""
+        out = defaultdict(int)
+        for entry in self.between(start, end, owner): out[entry["follow_up_date"]] += 1
+        return out
+
+    def overdue(self, today, owner=None, days=7):
+        """最近 days 天內已過提醒日的提醒"""
+        return self.between((today - datetime.timedelta(days=days)).strftime("%Y-%m-%d"),
+                            (today - datetime.timedelta(days=1)).strftime("%Y-%m-%d"), owner)
+
+    def upcoming(self, today, owner=None, days=7):
+        """今天起 days 天內的提醒"""
+        return self.between(today.strftime("%Y-%m-%d"), (today + datetime.timedelta(days=days - 1)).strftime("%Y-%m-%d"), owner)
+
+class UserIndex(DerivedIndex):
+    """帳號索引：username → 帳號資料，登入與註冊不必讀取整張 users"""
+    tables = ("users",)
+
+    def build(self, df):
+        self.users = {}
+        for row in df.to_dict("records"): self._set(row)
+
+    def _set(self, row):
+        username = _value(row.get("username"))
+        if username is not None: self.users[str(username)] = {k: _value(v) for k, v in row.items()}
+
+    def apply(self, name, op, *args):
+        if op == "append":
+            for row in args[0]: self._set(row)
+        elif op == "update":
+            key, values = args
+            if key not in self.users: return False
+            self._set({**self.users[key], **values})
+        elif op == "delete":
+            for key in args[0]: self.users.pop(key, None)
+        else: return False
+        return True
+
+    def get(self, username):
+        with self.lock:
+            user = self.users.get(username)
+            return dict(user) if user else None
+
+def _after_write(op, worksheet_name, version, *args):
+    """寫入本機後 (變更已在同一交易寫入 _outbox)：讓快取失效、增量更新索引，並喚醒背景同步"""
+    get_cache().invalidate(worksheet_name)
+    get_indexes().notify(worksheet_name, version, op, *args)
+    worker = get_sync_worker()
+    if worker is not None: worker.wake.set()
+
+def get_data(worksheet_name, owner=None):
+    """讀取某個分頁的所有資料；指定 owner (業務帳號) 時只讀取該業務客戶的資料"""
+    try:
+        # 回傳副本，避免呼叫端修改到共用的快取
+        with timed(f"get_data:{worksheet_name}") as m:
+            df = get_cache().get(get_store(), worksheet_name, owner).copy()
+            m["bytes"] = _nbytes(df)
+        return df
+    except Exception as e:
+        st.error(f"讀取 {worksheet_name} 失敗: {e}")
+        return pd.DataFrame()
+
+def get_rows(worksheet_name, column, value):
+    """只讀取某欄位等於指定值的資料列 (例如某位客戶的銷售紀錄)"""
+    try:
+        with timed(f"get_rows:{worksheet_name}") as m:
+            df = coerce(worksheet_name, get_store().select(worksheet_name, column, value))
+            m["bytes"] = _nbytes(df)
+        return df
+    except Exception as e:
+        st.error(f"讀取 {worksheet_name} 失敗: {e}")
+        return pd.DataFrame()
+
+def insert_data(worksheet_name, row):
+    """新增一筆資料列 (只寫入這一列)"""
+    row = {k: _value(v) for k, v in row.items()}
+    try:
+        with timed(f"insert_data:{worksheet_name}") as m:
+            m["bytes"] = len(json.dumps(row, ensure_ascii=False).encode())
+            version = get_store().append(worksheet_name, [row])
+            _after_write("append", worksheet_name, version, [row])
+        st.toast(f"已新增: {worksheet_name}")
+        return True
+    except Exception as e:
+        st.error(f"寫入 {worksheet_name} 失敗: {e}")
+        return False
+
+def update_data(worksheet_name, key, values, toast=True, expected=None):
+    """依主鍵更新一筆資料列的指定欄位；expected 為讀取時的 row_version，別人先改過時顯示衝突、不寫入"""
+    try:
+        with timed(f"update_data:{worksheet_name}") as m:
+            version, values = get_store().update(worksheet_name, key, values, expected)
+            m["bytes"] = len(json.dumps(values, ensure_ascii=False).encode())
+            _after_write("update", worksheet_name, version, _value(key), values)
+        if toast: st.toast(f"已更新: {worksheet_name}")
+        return True
+    except Exception as e:
+        # 版本衝突 (ConflictError) 的訊息已說明原因；get_store() 的實例來自較早的 rerun，不能用本輪的類別另外 except
+        st.error(f"更新 {worksheet_name} 失敗: {e}")
+        return False
+
+def delete_data(worksheet_name, keys, expected=None):
+    """依主鍵刪除資料列 (連同參照它們的子表資料)；expected 為 {主鍵: 讀取時的 row_version}"""
+    keys = [_value(k) for k in keys]
+    if not keys: return True
+    try:
+        with timed(f"delete_data:{worksheet_name}"):
+            for name, (version, deleted) in get_store().delete(worksheet_name, keys, expected).items():
+                _after_write("delete", name, version, deleted)
+        return True
+    except Exception as e:
+        st.error(f"刪除 {worksheet_name} 失敗: {e}")
+        return False
+
+def get_next_id(worksheet_name):
+    """產生新的 ID (模擬 Auto Increment)，同時儲存的 session 不會拿到相同的 id"""
+    return get_store().allocate_ids(worksheet_name)[0]
+
+# PBKDF2 次數：OWASP 建議值，bench_crm.py login 量測單次約 0.25 秒；調高後舊雜湊會在下次登入時自動升級
+PASSWORD_ITERATIONS = 600_000
+
+def hash_password(password, salt=None, iterations=PASSWORD_ITERATIONS):
+    """PBKDF2-HMAC-SHA256 加鹽雜湊，格式為 pbkdf2_sha256$次數$鹽$雜湊"""
+    salt = salt or os.urandom(16).hex()
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode(), bytes.fromhex(salt), iterations).hex()
+    return f"pbkdf2_sha256${iterations}${salt}${digest}"
+
+def check_password(password, stored):
+    """回傳 (密碼是否正確, 是否需要重新雜湊)；相容舊版未加鹽的 SHA-256"""
+    stored = str(stored or "")
+    if stored.startswith("pbkdf2_sha256$"):
+        try:
+            _, iterations, salt, _ = stored.split("$")
+            ok = hmac.compare_digest(hash_password(password, salt, int(iterations)), stored)
+        except ValueError: return False, False  # 手動改壞或被截斷的雜湊值視為登入失敗
+        return ok, ok and int(iterations) < PASSWORD_ITERATIONS
+    ok = hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), stored)
+    return ok, ok
+
+def verify_user(username, password):
+    user = get_index(UserIndex).get(username)
+    if user is None:
+        # 帳號不存在時也做一次雜湊，回應時間才不會透露帳號是否存在
+        hash_password(password, salt="00" * 16)
+        return False, None, None
+
+    ok, rehash = check_password(password, user.get('password'))
+    if not ok: return False, None, None
+    if rehash: update_data("users", username, {"password": hash_password(password)}, toast=False)
+    return True, user.get('role'), user.get('sales_name')
+
+def create_user(username, password, name, role='operator'):
+    if get_index(UserIndex).get(username) is not None:
+        return False
+    
+    return insert_data("users", {
+        "username": username,
+        "password": hash_password(password),
+        "role": role,
+        "sales_name": name
+    })
+
+# --- 批次匯入 / 匯出 ---
+IMPORT_TABLES = {"clients": "客戶", "sales": "購買紀錄", "interactions": "跟進紀錄"}
+IMPORT_REQUIRED = {"clients": ["name"], "sales": ["client_id", "transaction_date", "sale_amount"], "interactions": ["client_id"]}
+IMPORT_CHUNK_ROWS = 5000
+
+def _import_columns(worksheet_name):
+    """匯入檔的欄位：id 與 row_version 由系統維護"""
+    return [c for c in TABLES[worksheet_name][1] if c not in ("id", ROW_VERSION)]
+
+def _read_chunks(file, chunksize):
+    """CSV 以串流方式分批讀取；Excel (.xlsx，需要 openpyxl) 無法串流，讀入後再分批"""
+    if str(getattr(file, "name", file)).lower().endswith(".xlsx"):
+        df = pd.read_excel(file, dtype=str)
+        for i in range(0, len(df), chunksize): yield df.iloc[i:i + chunksize]
+    else:
+        yield from pd.read_csv(file, dtype=str, chunksize=chunksize, encoding="utf-8-sig")
+
+def _import_context(worksheet_name):
+    """驗證需要的既有資料：客戶的電話 / 統編 (去重) 或客戶 id 與負責業務 (檢查關聯)"""
+    if worksheet_name == "clients":
+        index = get_index(ClientSearchIndex)
+        with index.lock:
+            return {"phones": {k for k, v in index.phones.items() if v}, "tax_ids": {k for k, v in index.tax_ids.items() if v}}
+    df = get_data("clients")
+    return {"owners": dict(zip(df['id'].map(_value), df['created_by'].map(_value)))}
+
+def _validate_chunk(worksheet_name, raw, ctx, user):
+    """驗證一批匯入資料，回傳 (可寫入的資料, 被拒絕的原始資料與原因)"""
+    raw = raw.rename(columns=lambda c: str(c).strip())
+    df = raw.reindex(columns=_import_columns(worksheet_name))
+    today = datetime.date.today().strftime("%Y-%m-%d")
+    if worksheet_name == "clients":
+        df['created_at'] = df['created_at'].fillna(today)
+        df['created_by'] = df['created_by'].fillna(user)
+    elif worksheet_name == "sales":
+        # 業績預設歸屬客戶的負責業務
+        df['created_by'] = df['created_by'].fillna(pd.to_numeric(df['client_id'], errors='coerce').map(ctx["owners"]))
+    else:
+        df['updated_by'] = df['updated_by'].fillna(user)
+    typed = coerce(worksheet_name, df.copy())
+
+    # 有填但無法辨識的日期 / 金額不能默默存成空值
+    bad = _unparsed(worksheet_name, df, typed)
+    reason = ("無法辨識的 " + bad).where(bad != "", "")
+    df = typed
+    for c in IMPORT_REQUIRED[worksheet_name]:
+        reason = reason.mask((reason == "") & df[c].isna(), f"缺少 {c}")
+    if worksheet_name == "clients":
+        # 與既有客戶及檔案內前面的列比對電話與統編
+        normed = {"phones": df['phone'].map(_digits), "tax_ids": df['invoice_number'].map(_norm)}
+        for key, label in (("phones", "電話重複"), ("tax_ids", "統編重複")):
+            values = normed[key]
+            dup = (values != "") & (values.isin(ctx[key]) | values.duplicated())
+            reason = reason.mask((reason == "") & dup, label)
+        for key, values in normed.items(): ctx[key].update(values[(reason == "") & (values != "")])
+    else:
+        reason = reason.mask((reason == "") & ~df['client_id'].isin(list(ctx["owners"])), "客戶不存在")
+
+    ok = reason == ""
+    return df[ok], raw[~ok].assign(原因=reason[~ok])
+
+def import_rows(worksheet_name, file, user, chunksize=IMPORT_CHUNK_ROWS, progress=None):
+    """批次匯入 CSV / Excel：分批驗證、去重、批次配發 id，全部在一個交易內寫入。
+    回傳 (匯入筆數, 被拒絕的資料 (最多 100 筆), 被拒絕筆數)"""
+    ctx = _import_context(worksheet_name)
+    rejected, n_rejected, seen = [], 0, 0
+
+    def accepted():
+        nonlocal n_rejected, seen
+        for raw in _read_chunks(file, chunksize):
+            ok, bad = _validate_chunk(worksheet_name, raw, ctx, user)
+            n_rejected += len(bad)
+            if sum(map(len, rejected)) < 100: rejected.append(bad.head(100))
+            seen += len(raw)
+            if progress: progress(seen)
+            yield ok
+
+    with timed(f"import:{worksheet_name}"):
+        version, imported = get_store().bulk_append(worksheet_name, accepted())
+        _after_write("import", worksheet_name, version)
+    return imported, pd.concat(rejected).head(100) if rejected else pd.DataFrame(), n_rejected
+
+def export_csv(worksheet_name, chunksize=IMPORT_CHUNK_ROWS):
+    """分批匯出成 CSV (UTF-8 BOM，Excel 可直接開啟)：逐批寫入暫存檔，記憶體只保留一批；
+    回傳已回到開頭的檔案物件 (關閉時自動刪除)"""
+    with timed(f"export:{worksheet_name}") as m:
+        f = tempfile.TemporaryFile()
+        f.write(codecs.BOM_UTF8)
+        for i, chunk in enumerate(get_store().iter_chunks(worksheet_name, chunksize)):
+            f.write(chunk.to_csv(index=False, header=i == 0).encode("utf-8"))
+        m["bytes"] = f.tell()
+        f.seek(0)
+    return f
+
+@st.cache_resource
+def get_img_as_base64(file):
+    """圖檔每個程序只讀取、編碼一次"""
+    if not os.path.exists(file): return None
+    try:
+        with open(file, "rb") as f: data = f.read()
+        return base64.b64encode(data).decode()
+    except: return None
+
+# --- 3. 頁面功能 ---
+DATE_COLUMN = st.column_config.DateColumn(format="YYYY-MM-DD")
+
+@timed("render:login")
+def page_login_register():
+    st.markdown("<br><br><br>", unsafe_allow_html=True)
+    c_left, c_right = st.columns([2, 3], gap="large")
+    
+    img_path = "png-02.png" 
+    img_base64 = get_img_as_base64(img_path)
+
+    with c_left:
+        st.markdown("""<div style='display: flex; flex-direction: column; justify-content: center; align-items: center; height: 100%;'>""", unsafe_allow_html=True)
+        if img_base64:
+            st.markdown(f'<img src="data:image/png;base64,{img_base64}" style="max-width: 280px;">', unsafe_allow_html=True)
+        else:
+            st.markdown("<h1>☁️ CRM</h1>", unsafe_allow_html=True)
+        st.markdown("</div>", unsafe_allow_html=True)
+
+    with c_right:
+        st.markdown("<br>", unsafe_allow_html=True)
+        tab1, tab2 = st.tabs(["登入", "註冊 (操作員)"])
+        
+        with tab1:
+            with st.form("login_form"):
+                u = st.text_input("帳號", key="login_u")
+                p = st.text_input("密碼", type="password", key="login_p")
+                if st.form_submit_button("登入", type="primary", use_container_width=True):
+                    is_valid, role, s_name = verify_user(u, p)
+                    if is_valid:
+                        st.session_state['logged_in'] = True
+                        st.session_state['user'] = u
+                        st.session_state['role'] = role
+                        st.session_state['real_name'] = s_name
+                        st.rerun()
+                    else: st.error("帳號或密碼錯誤")
+        
+        with tab2:
+            with st.form("reg"):
+                nu = st.text_input("設定帳號")
+                nn = st.text_input("業務姓名 (顯示名稱)")
+                np = st.text_input("設定密碼", type="password")
+                if st.form_submit_button("註冊", type="primary", use_container_width=True):
+                    if len(nu)>0 and len(np)>0 and len(nn)>0:
+                        if create_user(nu, np, nn, 'operator'): 
+                            st.toast(f"註冊成功！歡迎 {nn}，請重新登入。")
+                            st.rerun()
+                        else: st.error("帳號已存在")
+                    else: st.error("所有欄位皆為必填")
+
+@timed("render:client_detail")
+def render_client_detail(client_id):
+    # 只讀取這位客戶 (依主鍵查詢)，再檢查權限
+    client_row = get_rows("clients", "id", client_id)
+
+    if client_row.empty: st.session_state['selected_client_id'] = None; st.rerun(); return
+    
+    # 轉成 dict 方便使用 (缺值轉成 None，日期轉成字串)
+    c_data = {k: _value(v) for k, v in client_row.iloc[0].to_dict().items()}
+    
+    user_role = st.session_state.get('role', 'operator')
+    current_user = st.session_state.get('user')
+    # 畫面上顯示的是哪一版：送出時拿上一輪記下的版本比對，期間有人改過就會衝突而不是覆蓋
+    seen_key = f"client_seen_version_{client_id}"
+    seen_version = st.session_state.get(seen_key, c_data[ROW_VERSION] or 0)
+    st.session_state[seen_key] = c_data[ROW_VERSION] or 0
+    
+    if user_role != 'admin' and c_data['created_by'] != current_user:
+        st.error("⛔ 您沒有權限查看此客戶資料。")
+        if st.button("返回"): st.session_state['selected_client_id'] = None; st.rerun()
+        return
+
+    if st.button("⬅️ 返回客戶列表"):
+        st.session_state['selected_client_id'] = None
+        st.rerun()
+
+    df_cats = get_data("categories")
+    cats = df_cats['name'].tolist() if not df_cats.empty else []
+    
+    # 累積消費取自客戶帳本 (操作員用自己的分區)，購買紀錄只讀取這位客戶的銷售
+    total_spent, n_sales, last_day = get_index(ClientLedger, _owner_scope()).get(client_id)
+    client_sales = get_rows("sales", "client_id", client_id)
+    last_info = f" · {n_sales} 筆 · 最後購買 {last_day}" if n_sales else ""
+
+    st.markdown(f"### 👤 {c_data['name']} <span style='font-size:0.6em; color:#a0aec0'>(累積消費: ${total_spent:,.0f}{last_info})</span>", unsafe_allow_html=True)
+    
+    with st.expander("✏️ 編輯基本資料"):
+        with st.form("edit_client"):
+            c1, c2, c3 = st.columns(3)
+            with c1:
+                nn = st.text_input("名稱", value=c_data['name'])
+                nph = st.text_input("電話", value=c_data['phone'])
+                nem = st.text_input("Email", value=c_data['email'])
+            with c2:
+                ncat = st.selectbox("分類", cats, index=cats.index(c_data['category']) if c_data['category'] in cats else 0)
+                nproj = st.text_input("專案", value=c_data['project'])
+            with c3:
+                ntitle = st.text_input("抬頭 (Title)", value=c_data['title'])
+                ninv = st.text_input("統編 (Tax ID)", value=c_data['invoice_number'])
+            
+            if st.form_submit_button("💾 更新資料", type="primary"):
+                # 只更新這一列
+                if update_data("clients", client_id, {"name": nn, "phone": nph, "email": nem, "category": ncat, "project": nproj, "title": ntitle, "invoice_number": ninv},
+                               expected=seen_version):
+                    st.rerun()
+
+    st.markdown("---")
+    t1, t2, t3 = st.tabs(["💰 購買紀錄", "📝 跟進紀錄", "🕒 歷史紀錄"])
+    
+    with t1:
+        # 顯示購買紀錄
+        if not client_sales.empty:
+            client_sales = client_sales.sort_values('transaction_date', ascending=False)
+        
+        if user_role == 'admin':
+            st.info("➕ 新增購買紀錄")
+            sales_owner = c_data['created_by']
+            st.caption(f"ℹ️ 業績歸屬：**{sales_owner}**")
+            with st.form("add_sale"):
+                c1, c2, c3 = st.columns([2,3,2])
+                sd = c1.date_input("日期", datetime.date.today())
+                si = c2.text_input("項目")
+                sinv = c2.text_input("發票")
+                sa = c3.number_input("金額", min_value=0)
+                if st.form_submit_button("➕ 新增", type="primary"):
+                    if si:
+                        if insert_data("sales", {
+                            "id": get_next_id("sales"),
+                            "client_id": client_id,
+                            "transaction_date": sd.strftime("%Y-%m-%d"),
+                            "item_name": si,
+                            "invoice_number": sinv,
+                            "sale_amount": sa,
+                            "created_by": sales_owner
+                        }):
+                            st.rerun()
+                    else: st.error("請輸入項目")
+        else: st.warning("🔒 僅管理員可新增")
+
+        if not client_sales.empty:
+            for idx, row in client_sales.iterrows():
+                with st.container():
+                    cols = st.columns([2, 3, 2, 2])
+                    cols[0].write(_day(row['transaction_date']))
+                    cols[1].write(f"**{row['item_name']}**")
+                    cols[2].write(f"發票: {row['invoice_number']}")
+                    cols[3].write(f"${row['sale_amount']:,.0f}")
+                    st.markdown("<hr style='margin:5px 0; border-color:#2d3342'>", unsafe_allow_html=True)
+
+    with t2:
+        with st.form("add_inter"):
+            c1, c2 = st.columns(2)
+            ld = c1.date_input("日期", datetime.date.today())
+            fd = c2.date_input("提醒日", datetime.date.today()+datetime.timedelta(days=3))
+            cnt = st.text_area("內容")
+            rem = st.text_input("提醒")
+            if st.form_submit_button("💾 儲存", type="primary"):
+                if cnt or rem:
+                    if insert_data("interactions", {
+                        "id": get_next_id("interactions"),
+                        "client_id": client_id,
+                        "log_date": ld.strftime("%Y-%m-%d"),
+                        "content": cnt,
+                        "follow_up_date": fd.strftime("%Y-%m-%d"),
+                        "reminder_note": rem,
+                        "updated_by": st.session_state['user']
+                    }):
+                        st.rerun()
+                else: st.error("需填寫內容")
+
+    with t3:
+        c_inter = get_rows("interactions", "client_id", client_id)
+        if not c_inter.empty:
+            c_inter = c_inter.sort_values('log_date', ascending=False)
+            st.dataframe(c_inter[['log_date','content','follow_up_date','reminder_note','updated_by']], use_container_width=True, hide_index=True,
+                         column_config={c: DATE_COLUMN for c in ('log_date', 'follow_up_date')})
+
+    st.markdown("<br>", unsafe_allow_html=True)
+    with st.expander("🗑️ 刪除客戶"):
+        if user_role == 'admin':
+            if st.button("確認永久刪除", type="secondary"):
+                # 客戶與其購買、跟進紀錄在同一交易內刪除 (客戶在這期間被改過就不刪)
+                if delete_data("clients", [client_id], expected={client_id: seen_version}):
+                    st.session_state['selected_client_id'] = None; st.rerun()
+
+@timed("render:add_client")
+def render_add_client():
+    st.title("➕ 新增客戶")
+    df_cats = get_data("categories")
+    cats = df_cats['name'].tolist() if not df_cats.empty else []
+    
+    with st.form("new_c"):
+        c1, c2 = st.columns(2)
+        n = c1.text_input("名稱 (必填)")
+        p = c1.text_input("電話")
+        e = c1.text_input("Email")
+        cat = c1.selectbox("分類", cats)
+        proj = c2.text_input("合作項目")
+        title = c2.text_input("抬頭")
+        inv = c2.text_input("統編")
+        if st.form_submit_button("🚀 建立", type="primary"):
+            if n:
+                # 檢查重複電話 (選用)
+                if p and get_index(ClientSearchIndex).find_phone(p):
+                    st.warning("此電話號碼已存在")
+                else:
+                    new_id = get_next_id("clients")
+                    if insert_data("clients", {
+                        "id": new_id,
+                        "name": n, "phone": str(p), "email": e, "project": proj,
+                        "title": title, "invoice_number": str(inv), "category": cat,
+                        "created_at": datetime.datetime.now().strftime("%Y-%m-%d"),
+                        "created_by": st.session_state['user']
+                    }):
+                        st.success("成功")
+            else: st.error("名稱必填")
+
+@timed("render:report")
+def render_report():
+    st.title("📊 業績報表 (Google Sheets)")
+
+    # 排行與總業績直接取自彙總索引，不重新掃描銷售紀錄
+    rollup = get_index(SalesRollup)
+    if not rollup.rows: st.info("尚無資料"); return
+
+    df_users = get_data("users")
+    names = dict(zip(df_users['username'], df_users['sales_name'])) if not df_users.empty else {}
+    def sales_name(owner): return names[owner] if pd.notna(names.get(owner)) else owner
+    owners_by_name = defaultdict(list)
+    for o in rollup.owners(): owners_by_name[sales_name(o)].append(o)
+
+    users = ["🏢 全公司總覽"] + sorted(owners_by_name)
+    selected_user = st.selectbox("檢視對象", users)
+    owners = None if selected_user == "🏢 全公司總覽" else owners_by_name[selected_user]
+
+    # 排行榜
+    if owners is None:
+        c1, c2 = st.columns(2)
+        for col, label, period in ((c1, "本月排行", datetime.datetime.now().strftime('%Y-%m')),
+                                   (c2, "本年排行", datetime.datetime.now().strftime('%Y'))):
+            with col:
+                st.markdown(f"##### {label}")
+                rank = pd.Series(rollup.rank(period), dtype=float)
+                if not rank.empty:
+                    st.bar_chart(rank.groupby(rank.index.map(sales_name)).sum().sort_values(ascending=False))
+
+    today = datetime.date.today()
+    c1, c2 = st.columns(2)
+    c1.metric("總業績", f"${rollup.range_total(owners=owners):,.0f}")
+    period = c2.date_input("期間", (today.replace(month=1, day=1), today))
+    if isinstance(period, (tuple, list)) and len(period) == 2:
+        c2.metric("期間業績", f"${rollup.range_total(period[0].strftime('%Y-%m-%d'), period[1].strftime('%Y-%m-%d'), owners):,.0f}")
+
+    # 交易明細需要合併三張表，勾選時才載入
+    if st.checkbox("顯示交易明細"):
+        df_sales = get_data("sales")
+        df_clients = get_data("clients")
+        merged = pd.merge(df_sales, df_clients[['id', 'name']], left_on='client_id', right_on='id', how='left')
+        merged['sales_name'] = merged['created_by'].map(sales_name)
+        display_df = merged if owners is None else merged[merged['created_by'].isin(owners)]
+        st.dataframe(display_df[['transaction_date','name','item_name','sale_amount','sales_name']], use_container_width=True,
+                     column_config={'transaction_date': DATE_COLUMN})
+
+def _owner_scope():
+    """管理員看全部 (None)，操作員只看自己的客戶與其相關資料"""
+    return None if st.session_state.get('role') == 'admin' else st.session_state.get('user')
+
+@timed("render:month_grid")
+def render_month_grid(year, month, counts):
+    """月曆格：每天顯示提醒件數"""
+    head = "".join(f"<th>{d}</th>" for d in "一二三四五六日")
+    body = ""
+    for week in calendar.Calendar().monthdayscalendar(year, month):
+        cells = ""
+        for d in week:
+            n = counts.get(f"{year:04d}-{month:02d}-{d:02d}", 0) if d else 0
+            badge = f"<br><span class='role-tag role-admin'>{n}</span>" if n else ""
+            cells += f"<td style='padding:6px; vertical-align:top; border:1px solid #2d3342'>{d or ''}{badge}</td>"
+        body += f"<tr>{cells}</tr>"
+    st.markdown(f"<table style='width:100%; text-align:center'><tr>{head}</tr>{body}</table>", unsafe_allow_html=True)
+
+@timed("render:calendar")
+def render_calendar():
+    st.title("📅 行事曆")
+    owner = _owner_scope()
+    reminders = get_index(ReminderIndex, owner)
+    if not reminders.rows: st.info("無待辦"); return
+
+    if 'cal_date' not in st.session_state: st.session_state['cal_date'] = datetime.date.today()
+    
+    c1, c2 = st.columns([4, 3])
+    with c1:
+        sel = st.date_input("選擇日期", key="cal_date")
+        first = sel.replace(day=1)
+        last = sel.replace(day=calendar.monthrange(sel.year, sel.month)[1])
+        st.markdown(f"##### {sel.year} 年 {sel.month} 月")
+        render_month_grid(sel.year, sel.month, reminders.counts(first.strftime("%Y-%m-%d"), last.strftime("%Y-%m-%d"), owner))
+            
+    with c2:
+        target_date = sel.strftime("%Y-%m-%d")
+        tasks = reminders.on(target_date, owner)
+        st.subheader(f"{target_date} 待辦")
+        if tasks:
+            for r in tasks:
+                st.info(f"客戶: {r['name']} | 事項: {r['reminder_note']}")
+        else: st.caption("無事項")
+
+@timed("render:import_export")
+def render_import_export():
+    st.title("📥 匯入 / 匯出")
+    name = st.selectbox("資料表", list(IMPORT_TABLES), format_func=IMPORT_TABLES.get)
+    cols = ", ".join(_import_columns(name))
+    st.caption(f"欄位: {cols}（id 由系統配發；必填: {', '.join(IMPORT_REQUIRED[name])}）")
+
+    t1, t2, t3 = st.tabs(["匯入", "匯出", "資料維護"])
+    with t1:
+        file = st.file_uploader("CSV 或 Excel 檔", type=["csv", "xlsx"])
+        if file is not None and st.button("🚀 開始匯入", type="primary"):
+            status = st.empty()
+            try:
+                imported, rejected, n_rejected = import_rows(name, file, st.session_state['user'],
+                                                             progress=lambda n: status.caption(f"已處理 {n:,} 列…"))
+            except Exception as e:
+                st.error(f"匯入失敗，沒有寫入任何資料: {e}")
+            else:
+                st.success(f"已匯入 {imported:,} 筆，略過 {n_rejected:,} 筆")
+                if n_rejected: st.dataframe(rejected, use_container_width=True, hide_index=True)
+    with t2:
+        if st.button("準備匯出檔"):
+            # download_button 本身會把內容整份放在記憶體，這裡只讀一次檔案，不再有中間的字串副本
+            with export_csv(name) as f:
+                st.download_button("⬇️ 下載 CSV", f.read(), file_name=f"{name}.csv", mime="text/csv")
+    with t3:
+        # 舊版刪除客戶時沒有一併刪除跟進紀錄，留下的孤兒資料在這裡一次清掉
+        orphans = get_store().orphans()
+        st.caption("客戶已不存在的資料: " + "，".join(f"{IMPORT_TABLES[t]} {n:,} 筆" for t, n in orphans.items()))
+        if st.button("🧹 清除孤兒資料", disabled=not any(orphans.values())):
+            try:
+                deleted = get_store().compact_orphans()
+            except Exception as e:
+                st.error(f"清除失敗: {e}")
+            else:
+                for t, (version, keys) in deleted.items(): _after_write("delete", t, version, keys)
+                st.success("已刪除 " + "，".join(f"{IMPORT_TABLES[t]} {len(keys):,} 筆" for t, (_, keys) in deleted.items()))
+
+# 效能診斷表格的欄位名稱
+METRIC_COLUMNS = {"page": "頁面", "section": "區段", "count": "次數", "p50_ms": "p50 (ms)", "p95_ms": "p95 (ms)",
+                  "total_s": "累計 (秒)", "bytes": "資料量 (bytes)"}
+
+def render_diagnostics():
+    st.title("🩺 效能診斷")
+    metrics, cs = get_metrics(), cache_stats()
+    gauges = {"crm_cache_hits": cs['hits'], "crm_cache_misses": cs['misses'], "crm_sync_pending": get_store().outbox_size()}
+    st.caption(f"自 {datetime.datetime.fromtimestamp(metrics.since):%Y-%m-%d %H:%M:%S} 起統計 (所有 session)，"
+               f"分位數取每個區段最近 {METRIC_SAMPLES} 次")
+    rows = pd.DataFrame(metrics.summary(), columns=list(METRIC_COLUMNS))
+    if rows.empty: st.info("尚無量測資料")
+    else:
+        page = st.selectbox("頁面", ["全部"] + sorted(rows['page'].unique()))
+        if page != "全部": rows = rows[rows['page'] == page]
+        st.dataframe(rows.sort_values("total_s", ascending=False).rename(columns=METRIC_COLUMNS), use_container_width=True, hide_index=True)
+
+    c1, c2, c3 = st.columns(3)
+    c1.download_button("⬇️ 匯出 JSON", metrics.to_json({"gauges": gauges}), file_name="crm-metrics.json", mime="application/json")
+    c2.download_button("⬇️ 匯出 Prometheus", metrics.to_prometheus(gauges), file_name="crm-metrics.prom", mime="text/plain")
+    if c3.button("重設統計"): metrics.reset(); st.rerun()
+
+@timed("render:reminder_summary")
+def render_reminder_summary():
+    """首頁提醒摘要：近 7 天逾期與未來 7 天的提醒"""
+    today, owner = datetime.date.today(), _owner_scope()
+    reminders = get_index(ReminderIndex, owner)
+    overdue, upcoming = reminders.overdue(today, owner), reminders.upcoming(today, owner)
+    if not overdue and not upcoming: return
+    with st.expander(f"⏰ 逾期 {len(overdue)} 件 · 未來 7 天 {len(upcoming)} 件"):
+        for r in overdue: st.warning(f"{r['follow_up_date']} | 客戶: {r['name']} | 事項: {r['reminder_note']}")
+        for r in upcoming: st.info(f"{r['follow_up_date']} | 客戶: {r['name']} | 事項: {r['reminder_note']}")
+
+# 客戶列表排序選項: 顯示名稱 → (欄位, 是否遞增)
+CLIENT_SORTS = {"最新建立": ("id", False), "名稱": ("name", True), "負責業務": ("created_by", True), "累積消費": ("total_spent", False)}
+
+@st.cache_resource
+def get_client_orders():
+    """客戶列表的排序結果 (跨 session 共用)：(業務, 排序) → (版本號, 客戶資料, 排序後的列位置)"""
+    return {}
+
+def _client_order(owner, sort):
+    """依 CLIENT_SORTS 排序後的列位置；客戶 (依累積消費排序時再加上銷售) 的版本沒變就沿用，換頁不必重新排序"""
+    store, (col, asc) = get_store(), CLIENT_SORTS[sort]
+    version, df = get_cache().get_versioned(store, "clients", owner)
+    if col == "total_spent": version = (version, _table_version(store, "sales", owner))
+    cached = get_client_orders().get((owner, sort))
+    if cached and cached[0] == version: return cached[1], cached[2]
+    with timed("client_list.sort"):
+        if col == "total_spent":
+            # 只有依累積消費排序時才需要每位客戶的消費
+            spent = get_index(ClientLedger, owner).spent()
+            keys = df['id'].map(spent).fillna(0)
+        else: keys = df[col]
+        positions = keys.reset_index(drop=True).sort_values(ascending=asc, kind="stable").index.to_numpy()
+    get_client_orders()[(owner, sort)] = (version, df, positions)
+    return df, positions
+
+def _client_positions(owner, ids):
+    """客戶 id (依 ids 的順序，例如搜尋結果) → 在客戶資料中的列位置；id → 位置的對照表依版本快取"""
+    version, df = get_cache().get_versioned(get_store(), "clients", owner)
+    cached = get_client_orders().get((owner, None))
+    if not cached or cached[0] != version:
+        cached = (version, df, pd.Index(df['id'].reset_index(drop=True)))
+        get_client_orders()[(owner, None)] = cached
+    positions = cached[2].get_indexer(list(ids))
+    return cached[1], positions[positions >= 0]
+
+def _goto_client_page(page): st.session_state['client_page'] = page
+def _reset_client_page(): st.session_state['client_page'] = 0
+
+@timed("render:client_list")
+def render_client_list():
+    st.title("👥 客戶名單")
+    render_reminder_summary()
+    if 'client_page' not in st.session_state: st.session_state['client_page'] = 0
+
+    # 搜尋 / 排序 / 每頁筆數都存在 session，換頁後保留
+    c1, c2, c3 = st.columns([4, 2, 1])
+    q = c1.text_input("🔍 搜尋 (名稱 / 電話 / 統編 / Email / 專案)", key="client_q", on_change=_reset_client_page)
+    sort = c2.selectbox("排序", list(CLIENT_SORTS), key="client_sort", on_change=_reset_client_page)
+    size = c3.selectbox("每頁", [20, 50, 100], key="client_page_size", on_change=_reset_client_page)
+
+    # 操作員只讀取自己的客戶 (在資料庫端篩選)，消費帳本與搜尋索引也只建自己的分區
+    owner = _owner_scope()
+    try:
+        if q:
+            # 搜尋時依相關度排序 (名稱 / 電話 / 統編 / Email / 專案)
+            df_clients, order = _client_positions(owner, get_index(ClientSearchIndex, owner).search(q))
+        else:
+            df_clients, order = _client_order(owner, sort)
+    except Exception as e:
+        st.error(f"讀取 clients 失敗: {e}"); return
+    if not len(order): st.info("無資料"); return
+
+    # 只渲染目前這一頁 (排序結果有快取，換頁只取這一頁的列)
+    total = len(order)
+    pages = max(1, -(-total // size))
+    page = min(st.session_state['client_page'], pages - 1)
+    view = df_clients.iloc[order[page * size:(page + 1) * size]]
+    ledger = get_index(ClientLedger, owner)
+
+    # Join User Name (只對這一頁查表)
+    df_users = get_data("users")
+    names = dict(zip(df_users['username'], df_users['sales_name'])) if not df_users.empty else {}
+
+    for _, row in view.iterrows():
+        with st.container():
+            c1, c2, c3, c4, c5 = st.columns([2, 2, 1, 2, 1])
+            c1.markdown(f"**{row['name']}**")
+            c2.text(f"📞 {_value(row['phone']) or ''}")
+            c3.text(f"${ledger.get(row['id'])[0]:,.0f}")
+            c4.markdown(f"<span class='owner-tag'>{names.get(row['created_by'], 'Unknown')}</span>", unsafe_allow_html=True)
+            if c5.button("查看", key=f"v_{row['id']}"):
+                st.session_state['selected_client_id'] = _value(row['id']); st.rerun()
+            st.markdown("<hr>", unsafe_allow_html=True)
+
+    p1, p2, p3 = st.columns([1, 3, 1])
+    p1.button("◀ 上一頁", disabled=page == 0, on_click=_goto_client_page, args=(page - 1,))
+    p2.caption(f"第 {page + 1} / {pages} 頁，共 {total} 筆")
+    p3.button("下一頁 ▶", disabled=page >= pages - 1, on_click=_goto_client_page, args=(page + 1,))
+
+def page_dashboard():
+    role = st.session_state.get('role', 'operator')
+    real_name = st.session_state.get('real_name', st.session_state['user'])
+    options = ["👥 客戶名單列表", "➕ 新增客戶", "📅 行事曆與提醒"]
+    if role == 'admin': options += ["📊 業績報表", "📥 匯入 / 匯出", "🩺 效能診斷"]
+    
+    if 'current_view' not in st.session_state: st.session_state['current_view'] = options[0]
+
+    with st.sidebar, timed("render:sidebar"):
+        st.title(f"Hi, {real_name}")
+        st.caption(f"身分: {role}")
+        if role == 'admin':
+            cs = cache_stats()
+            st.caption(f"快取 命中 {cs['hits']} / 未命中 {cs['misses']}")
+            worker = get_sync_worker()
+            if worker is not None:
+                st.caption(f"待同步 {get_store().outbox_size()} 筆")
+                for name, err in list(worker.errors.items()): st.caption(f"⚠️ {name}: {err}")
+        selected = st.radio("選單", options)
+        if selected != st.session_state['current_view']:
+            st.session_state['current_view'] = selected
+            st.session_state['selected_client_id'] = None
+            st.rerun()
+        if st.button("登出"): st.session_state['logged_in'] = False; st.rerun()
+
+    menu = st.session_state['current_view']
+    
+    if st.session_state.get('selected_client_id'):
+        render_client_detail(st.session_state['selected_client_id']); return
+
+    if menu == "👥 客戶名單列表": render_client_list()
+    elif menu == "➕ 新增客戶": render_add_client()
+    elif menu == "📅 行事曆與提醒": render_calendar()
+    elif menu == "📊 業績報表": render_report()
+    elif menu == "📥 匯入 / 匯出": render_import_export()
+    elif menu == "🩺 效能診斷": render_diagnostics()
+
+def main():
+    if 'logged_in' not in st.session_state: st.session_state['logged_in'] = False
+    with timed("rerun"):
+        local_css()
+        if not st.session_state['logged_in']: page_login_register()
+        else:
+            # 登入後才連線並啟動背景同步 (處理上次未送出的變更)，登入頁的首次繪製不必等 Sheets
+            get_sync_worker()
+            page_dashboard()
+
+
+if __name__ == "__main__": main()
+